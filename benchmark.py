@@ -0,0 +1,326 @@
+# Program    : PDFReader Benchmark
+# Description: Generate Synthetic Rankings Indicators PDFs and Time the PDF Reader against a Baseline
+
+
+# Imports
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import program
+
+# Global Files
+base_folder = os.path.dirname(__file__)
+baseline_file = os.path.join(base_folder, "benchmark_baseline.json")
+
+# Regions of the Synthetic Corpus
+synthetic_regions = [("national", "national"), ("north", "regional"), ("south", "regional"),
+                     ("midwest", "regional"), ("west", "regional")]
+
+# Report Lines
+# NOTE: Written in the layout the parser expects, the values are filled in per school
+national_lines = [
+    "{name} is ranked #{rank} in National Universities",
+    "Overall Score: {score} out of 100",
+    "Graduation Rate Performance Rank ({weight}%)",
+    "Predicted graduation rate: {pct}%",
+    "Overperformance(+)/Underperformance(-): +{small}",
+    "Alumni Giving ({weight}%)",
+    "Alumni giving rank: {rank2}",
+    "Average alumni giving rate: [1] {pct}%",
+    "Graduation and Retention Rates ({weight}%)",
+    "Graduation and retention rank: {rank2}",
+    "6-year graduation rate: {pct}%",
+    "Average freshman retention rate: {pct}%",
+    "Undergraduate Academic Reputation ({weight}%)",
+    "Peer assessment score (out of 5): {five}",
+    "High school counselor score (out of 5): {five}",
+    "Faculty Resources ({weight}%)",
+    "Faculty Resources Rank: {rank2}",
+    "Percent of faculty who are full-time: {pct}%",
+    "Full-time faculty with Ph.D or terminal degree: {pct}%",
+    "Classes with fewer than 20 students: {pct}%",
+    "Classes with 50 or more students: {pct}%",
+    "Student-faculty ratio: {small}:1",
+    "Student Selectivity ({weight}%)",
+    "Student selectivity rank: {rank2}",
+    "SAT/ACT 25th-75th percentile: {sat}",
+    "Freshmen in top 10 percent of high school class: {pct}%",
+    "Freshmen in top 25 percent of high school class: {pct}%",
+    "Fall 2016 acceptance rate: {pct}%",
+    "Financial Resources ({weight}%)",
+    "Financial resources rank: {rank2}",
+]
+regional_lines = [
+    "{name} is ranked #{rank} in Regional Universities",
+    "Overall Score: {score} out of 100",
+    "Graduation and Retention Rates ({weight}%)",
+    "Graduation and retention rank: {rank2}",
+    "Average 6-year graduation rate: {pct}%",
+    "6-year graduation rate of students who received a Pell Grant: {pct}%",
+    "6-year graduation rate of students who did not receive a Pell Grant: {pct}%",
+    "Difference between graduation rates of Pell and non-Pell students: {small}%",
+    "Average first-year student retention rate: {pct}%",
+    "Graduation Rate Performance ({weight}%)",
+    "Predicted graduation rate: {pct}%",
+    "Overperformance(+)/Underperformance(-): +{small}",
+    "Expert Opinion ({weight}%)",
+    "Peer assessment score (out of 5): {five}",
+    "High school counselor score (out of 5): {five}",
+    "Faculty Resources ({weight}%)",
+    "Faculty Resources Rank: {rank2}",
+    "Percent of faculty who are full-time: {pct}%",
+    "Full-time faculty with Ph.D or terminal degree: {pct}%",
+    "Classes with fewer than 20 students: {pct}%",
+    "Classes with 50 or more students: {pct}%",
+    "Student-faculty ratio: {small}:1",
+    "Student Excellence ({weight}%)",
+    "Student excellence rank: {rank2}",
+    "SAT/ACT 25th-75th percentile: {sat}",
+    "Freshmen in top 10 percent of high school class: {pct}%",
+    "Freshmen in top 25 percent of high school class: {pct}%",
+    "Financial Resources ({weight}%)",
+    "Financial resources rank: {rank2}",
+    "Alumni Giving ({weight}%)",
+    "Alumni giving rank: {rank2}",
+    "Average alumni giving rate: {pct}%",
+]
+report_lines = {"national": national_lines, "regional": regional_lines}
+
+# Lines per Page of the Synthetic PDFs
+page_lines = 45
+
+
+# Main
+def main(argv=None):
+    args, program_args = parse_arguments(argv)
+    print("Generating {} PDFs per region with {} pages each...".format(args.count, args.pages))
+
+    work_folder = tempfile.mkdtemp(prefix="pdfreader-benchmark-")
+    try:
+        config_file = generate_corpus(work_folder, args.count, args.pages, args.seed)
+        results = run_benchmark(work_folder, config_file, args.repeat, program_args)
+        results["retrieve_values_lines_per_sec"] = time_retrieve_values(args.seed)
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    results["corpus"] = {"count": args.count, "pages": args.pages, "seed": args.seed, "program_args": program_args}
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as output:
+            json.dump(results, output, indent=2)
+        print("\nSaved baseline to {}".format(args.baseline))
+        return 0
+
+    return compare_to_baseline(results, args.baseline, args.tolerance)
+
+
+# Command Line Arguments
+# NOTE: Arguments not known here are passed on to program.py, for example --workers 4 or --backend fast
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the PDF Reader on synthetic Rankings Indicators PDFs")
+    parser.add_argument("--count", type=int, default=20, help="PDFs per region (default: %(default)s)")
+    parser.add_argument("--pages", type=int, default=3, help="Pages per PDF (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs of the full export, the fastest one is kept (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=2018, help="Seed of the synthetic values (default: %(default)s)")
+    parser.add_argument("--baseline", default=baseline_file, help="Baseline file (default: %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Slowdown against the baseline reported as a regression (default: %(default)s)")
+
+    return parser.parse_known_args(argv)
+
+
+# Generate the Synthetic Corpus and its Region Config
+def generate_corpus(work_folder, count, pages, seed):
+    rand = random.Random(seed)
+    regions = []
+
+    for name, report_type in synthetic_regions:
+        folder = os.path.join(work_folder, "data", name)
+        os.makedirs(folder)
+        regions.append({"name": name, "folder": os.path.join("data", name), "report_type": report_type})
+
+        for index in range(count):
+            school = "{} School {}".format(name.title(), index + 1)
+            lines = [line.format(**synthetic_values(rand, school, index + 1)) for line in report_lines[report_type]]
+            pdf_file = os.path.join(folder, "{} _ Rankings Indicators.pdf".format(school))
+            with open(pdf_file, "wb") as output:
+                output.write(build_pdf(paginate(lines, pages, rand)))
+
+        # Files the Reader has to Skip
+        with open(os.path.join(folder, "notes.txt"), "w") as output:
+            output.write("Not a report\n")
+
+    for folder in ["export", "log", "cache"]:
+        os.makedirs(os.path.join(work_folder, folder))
+
+    config_file = os.path.join(work_folder, "regions.json")
+    with open(config_file, "w") as output:
+        json.dump({"regions": regions}, output, indent=4)
+
+    return config_file
+
+
+# Values of One School
+def synthetic_values(rand, school, rank):
+    low = rand.randint(900, 1300)
+    return {
+        "name": school,
+        "rank": rank,
+        "score": max(100 - rank, 1),
+        "rank2": rand.randint(1, 300),
+        "weight": rand.choice(["5", "7.5", "10", "12.5", "20", "22.5"]),
+        "pct": rand.randint(1, 99),
+        "small": rand.randint(1, 30),
+        "five": "{:.1f}".format(rand.uniform(1, 5)),
+        "sat": "{}-{}".format(low, low + rand.randint(100, 300)),
+    }
+
+
+# Spread the Report over the Pages
+# NOTE: The report fills the first pages and filler text pads the rest
+def paginate(lines, pages, rand):
+    result = [lines[start:start + page_lines] for start in range(0, len(lines), page_lines)]
+    while len(result) < pages:
+        result.append(["Methodology note {}: {}".format(line, rand.random()) for line in range(page_lines)])
+
+    return result
+
+
+# Build a PDF with One Text Block per Page
+# NOTE: Uses the standard Helvetica font so nothing needs to be embedded
+def build_pdf(pages):
+    objects = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_numbers = []
+    pages_number = 2 + 2 * len(pages)
+
+    for lines in pages:
+        text = "BT /F1 10 Tf 14 TL 50 750 Td " + " ".join("({}) Tj T*".format(escape_text(line)) for line in lines) + " ET"
+        stream = text.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 1 0 R >> >> /Contents %d 0 R >>" % (pages_number, len(objects)))
+        page_numbers.append(len(objects))
+
+    kids = b" ".join(b"%d 0 R" % number for number in page_numbers)
+    objects.append(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_numbers)))
+    objects.append(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_number)
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1,
+                                                                                    len(objects), xref))
+
+    return output.getvalue()
+
+
+# Escape Text for a PDF String
+def escape_text(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+# Time the Full Export
+# NOTE: Runs program.main against the synthetic corpus with the output folders pointed at it,
+#       every run starts from empty exports and skips the cache so every PDF is parsed
+def run_benchmark(work_folder, config_file, repeat, program_args):
+    folders = (program.export_folder, program.log_folder, program.cache_folder)
+    program.export_folder = os.path.join(work_folder, "export")
+    program.log_folder = os.path.join(work_folder, "log")
+    program.cache_folder = os.path.join(work_folder, "cache")
+
+    best = None
+    try:
+        for run in range(repeat):
+            report_file = os.path.join(work_folder, "report.json")
+            argv = ["--config", config_file, "--full", "--no-cache", "--report", report_file] + program_args
+
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                program.main(argv)
+            elapsed = time.perf_counter() - started
+
+            with open(report_file, "r") as report:
+                report = json.load(report)
+
+            if best is None or elapsed < best["main_seconds"]:
+                best = {"main_seconds": elapsed, "files": report["files"], "pages": report["pages"],
+                        "files_per_sec": report["files"] / elapsed, "pages_per_sec": report["pages"] / elapsed,
+                        "stages": report["stages"], "peak_rss_mb": report["peak_rss_mb"]}
+            print("Run {}: {:.2f}s".format(run + 1, elapsed))
+    finally:
+        program.export_folder, program.log_folder, program.cache_folder = folders
+
+    return best
+
+
+# Time retrieve_values on its Own
+def time_retrieve_values(seed, repeat=200):
+    rand = random.Random(seed)
+    text = "\n".join(line.format(**synthetic_values(rand, "Benchmark School", 1)) for line in regional_lines)
+    lines = len(regional_lines) * repeat
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        for run in range(repeat):
+            program.retrieve_values(text, "regional")
+        elapsed = time.perf_counter() - started
+
+    return lines / elapsed
+
+
+# Print the Results
+def print_results(results):
+    print("\nmain(): {:.2f}s for {} files, {:.2f} files/sec, {:.1f} pages/sec".format(
+        results["main_seconds"], results["files"], results["files_per_sec"], results["pages_per_sec"]))
+    for stage, seconds in results["stages"].items():
+        print("    {:<10} {:.3f}s".format(stage, seconds))
+    print("retrieve_values: {:.0f} lines/sec".format(results["retrieve_values_lines_per_sec"]))
+
+
+# Compare the Throughput with the Baseline
+def compare_to_baseline(results, baseline_path, tolerance):
+    try:
+        with open(baseline_path, "r") as baseline:
+            baseline = json.load(baseline)
+    except OSError:
+        print("\nNo baseline at {}, run with --save-baseline to store one".format(baseline_path))
+        return 0
+
+    if baseline.get("corpus") != results["corpus"]:
+        print("\nThe baseline was measured on a different corpus or program arguments: {}".format(baseline.get("corpus")))
+
+    regressions = 0
+    print("\nAgainst the baseline:")
+    for metric in ["files_per_sec", "pages_per_sec", "retrieve_values_lines_per_sec"]:
+        change = results[metric] / baseline[metric] - 1
+        flag = ""
+        if change < -tolerance:
+            regressions += 1
+            flag = "  REGRESSION"
+        print("    {:<30} {:+.1%}{}".format(metric, change, flag))
+
+    return 1 if regressions else 0
+
+
+# Main
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,45 +5,368 @@
 
 
 # Imports
+import argparse
 import csv
+import hashlib
 import io
+import json
 import os
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing, contextmanager
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import repeat
+from urllib.parse import parse_qs, urlparse
 from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.pdfpage import PDFPage
-from pdfminer.converter import TextConverter
-from pdfminer.layout import LAParams
+from pdfminer.converter import PDFPageAggregator, TextConverter
+from pdfminer.layout import LAParams, LTChar, LTFigure
+from pdfminer.pdftypes import PDFStream, resolve1
+from pdfminer.psparser import PSLiteral
+
+# Columnar Exports Need pyarrow
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Peak Memory is Only Reported Where the resource Module Exists
+try:
+    import resource
+except ImportError:
+    resource = None
 
 # Global Directories
 base_folder = os.path.dirname(__file__)
-national_folder = os.path.join(base_folder, "data", "national")
-north_regional_folder = os.path.join(base_folder, "data", "regional", "north")
-south_regional_folder = os.path.join(base_folder, "data", "regional", "south")
-midwest_regional_folder = os.path.join(base_folder, "data", "regional", "midwest")
-west_regional_folder = os.path.join(base_folder, "data", "regional", "west")
 export_folder = os.path.join(base_folder, "export")
 log_folder = os.path.join(base_folder, "log")
+cache_folder = os.path.join(base_folder, "cache")
+
+# Region Config
+# NOTE: Lists each region's name, PDF folder and report type, see regions.json
+regions_file = os.path.join(base_folder, "regions.json")
+Region = namedtuple("Region", ["name", "folder", "report_type"])
+
+# Shard i of N, Counted from 1
+# NOTE: A shard only parses its share of the PDFs and writes its exports, manifests and logs to
+#       shard-i-of-N folders under export and log, see merge_shards
+Shard = namedtuple("Shard", ["index", "count"])
+
+# Rows Buffered per Export File before Writing
+# NOTE: Columnar exports write each batch as one row group or record batch, so they take bigger ones
+export_batch_size = 100
+columnar_batch_size = 10000
+
+# Extraction Cache
+# NOTE: Bump the extractor version whenever parsing changes so cached rows are not reused
+extractor_version = "2"
+cache_size_limit = 256 * 1024 * 1024
+
+# Read-Ahead of the PDFs Parsed in the Main Process
+# NOTE: Up to prefetch_depth files are read into memory ahead of the parser, as long as they fit
+#       in prefetch_budget bytes together
+prefetch_depth = 4
+prefetch_budget = 64 * 1024 * 1024
 
-pdf_folders = [national_folder, north_regional_folder, south_regional_folder, midwest_regional_folder,
-               west_regional_folder]
+# Limits on Parsing a Single PDF
+# NOTE: timeout is in seconds and memory in bytes, 0 turns a limit off. With either limit set the
+#       PDFs are parsed in worker processes, even with a single worker, so a runaway file is stopped
+#       without taking the run down with it
+FileLimits = namedtuple("FileLimits", ["timeout", "memory"])
+file_timeout = 0
+file_memory_limit = 0
+default_limits = FileLimits(timeout=file_timeout, memory=file_memory_limit)
+
+# Seconds between Checkpoints of a Region's Progress
+checkpoint_interval = 30
+
+# Fonts Kept by Each Backend across PDFs
+# NOTE: Least recently used fonts are dropped once the specs they were built from (font files,
+#       ToUnicode maps, widths) add up to more than this many bytes
+font_cache_bytes = 32 * 1024 * 1024
+
+# Extraction Service
+# NOTE: serve listens on service_host only, requests name files the service reads itself and only
+#       from the folders of the configured regions. Uploads bigger than service_max_upload bytes are
+#       refused, requests past the concurrency limit wait up to service_queue_timeout seconds for a
+#       slot. The extraction cache is trimmed at most every service_cache_trim_interval seconds
+service_host = "127.0.0.1"
+service_port = 8765
+service_max_upload = 64 * 1024 * 1024
+service_queue_timeout = 30
+service_cache_trim_interval = 60
+
+# Page Limits per Report Type
+# NOTE: 0 renders every page, lower it when a report type keeps all its fields on the first pages
+report_max_pages = {"national": 0, "regional": 0}
+
+# How PDFs are Rendered
+# NOTE: backend names one of extraction_backends, early_exit stops rendering once every field of the
+#       report has been found, max_pages maps a report type to the pages rendered (0 for all of them)
+ExtractionSettings = namedtuple("ExtractionSettings", ["backend", "early_exit", "max_pages"])
+default_backend = "pdfminer"
+default_settings = ExtractionSettings(backend=default_backend, early_exit=False, max_pages=report_max_pages)
 
 
 # Main
-def main():
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["merge"]:
+        return merge_command(argv[1:])
+    if argv[:1] == ["serve"]:
+        return serve_command(argv[1:])
+
+    args = parse_arguments(argv)
     print_header()
 
+    regions = load_regions(args.config)
+
+    # Extraction Cache
+    cache = None
+    if not args.no_cache:
+        cache = ExtractionCache(cache_folder, args.cache_size * 1024 * 1024)
+        if args.rebuild_cache:
+            cache.clear()
+
+    # NOTE: Rebuilding the cache parses every PDF again, so the manifests are ignored as with --full
+    full = args.full or args.rebuild_cache
+
+    # Extraction Settings
+    settings = ExtractionSettings(backend=args.backend, early_exit=args.early_exit,
+                                  max_pages=parse_max_pages(args.max_pages))
+
+    # Backend Conformance Check
+    if args.check_backend:
+        return check_backend(regions, args.check_backend, args.workers, settings)
+
+    # Columnar Exports
+    if args.format != "csv" and pyarrow is None:
+        raise SystemExit("--format {} needs the pyarrow package".format(args.format))
+
+    # SQLite Store
+    store = RankingsStore(args.sqlite) if args.sqlite else None
+
+    # Per-File Limits
+    limits = FileLimits(timeout=args.timeout, memory=args.memory_limit * 1024 * 1024)
+
     # Run Functions
-    for index in range(len(pdf_folders)):
-        column_headers = get_column_headers(pdf_folders[index])
-        try:
-            export_to_csv(export_folder, column_headers, "w", pdf_folders[index])
-            search_through_files(pdf_folders[index])
-        except Exception as e:
-            print("Issue with reading file: {}".format(e))
+    stats = RunStats(args.log_json)
+    try:
+        search_through_regions(regions, args.workers, cache, full, settings, stats, args.format, store,
+                               args.prefetch, args.prefetch_mb * 1024 * 1024, args.shard, limits)
+    finally:
+        stats.close()
+        if store is not None:
+            store.close()
+
+    if cache is not None:
+        cache.trim()
+
+    # Run Report
+    report = stats.report()
+    print("\nExtracted {} files ({} from the cache, {} pages rendered) in {:.1f}s, {:.2f} files/sec".format(
+        report["files"], report["cache_hits"], report["pages"], report["wall_time"], report["files_per_sec"]))
+    if report["failed"]:
+        print("{} files failed, see errors.jsonl in the log folder".format(report["failed"]))
+    if args.report:
+        with open(args.report, "w") as output:
+            json.dump(report, output, indent=2)
 
     # End of Program
     print("\nComplete!")
 
 
+# Command Line Arguments
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Read PDF Files and Export Relevant Data to a CSV File")
+    parser.add_argument("--config", default=regions_file,
+                        help="Region config file (default: regions.json next to this program)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes used to parse PDFs (default: 1, serial)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Parse every PDF without reading or writing the extraction cache")
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="Empty the extraction cache before the run and parse every PDF again (implies --full)")
+    parser.add_argument("--cache-size", type=int, default=cache_size_limit // (1024 * 1024),
+                        help="Size cap of the extraction cache in MB (default: %(default)s)")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore the export manifests and re-export every PDF")
+    parser.add_argument("--prefetch", type=int, default=prefetch_depth, metavar="N",
+                        help="Read up to N PDFs ahead of the parser in a serial run, 0 turns it off "
+                             "(default: %(default)s)")
+    parser.add_argument("--prefetch-mb", type=int, default=prefetch_budget // (1024 * 1024), metavar="MB",
+                        help="Memory the read-ahead PDFs may take up in MB (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=file_timeout, metavar="SECONDS",
+                        help="Give up on a PDF after SECONDS, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--memory-limit", type=int, default=file_memory_limit // (1024 * 1024), metavar="MB",
+                        help="Memory a worker may use to parse a PDF in MB, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--early-exit", action="store_true",
+                        help="Stop rendering a PDF once every field of its report has been found")
+    parser.add_argument("--max-pages", action="append", default=[], metavar="[TYPE=]N",
+                        help="Render at most N pages of each PDF, or of one report type "
+                             "(national or regional), can be given more than once")
+    parser.add_argument("--backend", choices=sorted(extraction_backends), default=default_backend,
+                        help="Text extraction backend (default: %(default)s)")
+    parser.add_argument("--check-backend", choices=sorted(extraction_backends), metavar="BACKEND",
+                        help="Compare the rows of BACKEND with the --backend rows on every PDF "
+                             "instead of exporting")
+    parser.add_argument("--format", choices=["csv", "parquet", "arrow", "feather"], default="csv",
+                        help="Export format, parquet, arrow and feather have typed columns and need pyarrow "
+                             "(default: %(default)s)")
+    parser.add_argument("--sqlite", metavar="PATH",
+                        help="Also store the rows in the SQLite database at PATH, one table per report type")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N",
+                        help="Only parse shard i of N of the PDFs and write partial outputs to "
+                             "shard-i-of-N folders, combine them with the merge command")
+    parser.add_argument("--report", metavar="PATH",
+                        help="Write a JSON run report with per-file and per-stage timings to PATH")
+    parser.add_argument("--log-json", metavar="PATH",
+                        help="Write one JSON line of timings per parsed file to PATH")
+
+    return parser.parse_args(argv)
+
+
+# Merge Command Line
+def merge_command(argv):
+    parser = argparse.ArgumentParser(prog="program.py merge",
+                                     description="Combine the partial outputs of a sharded run into the exports")
+    parser.add_argument("--config", default=regions_file,
+                        help="Region config file (default: regions.json next to this program)")
+    parser.add_argument("--shards", type=int, required=True, metavar="N",
+                        help="Number of shards the run was split into")
+    parser.add_argument("--format", choices=["csv", "parquet", "arrow", "feather"], default="csv",
+                        help="Export format (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.format != "csv" and pyarrow is None:
+        raise SystemExit("--format {} needs the pyarrow package".format(args.format))
+
+    merge_shards(load_regions(args.config), args.shards, args.format)
+    print("\nComplete!")
+
+
+# Serve Command Line
+def serve_command(argv):
+    parser = argparse.ArgumentParser(prog="program.py serve",
+                                     description="Keep warm workers and answer extraction requests over HTTP")
+    parser.add_argument("--config", default=regions_file,
+                        help="Region config file, used to look up the report type of a region "
+                             "(default: regions.json next to this program)")
+    parser.add_argument("--host", default=service_host, help="Address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=service_port, help="Port to listen on (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="Number of warm worker processes (default: %(default)s)")
+    parser.add_argument("--max-concurrent", type=int, default=8, metavar="N",
+                        help="Requests handled at once, later ones wait for a slot (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Parse every PDF without reading or writing the extraction cache")
+    parser.add_argument("--backend", choices=sorted(extraction_backends), default=default_backend,
+                        help="Text extraction backend (default: %(default)s)")
+    parser.add_argument("--early-exit", action="store_true",
+                        help="Stop rendering a PDF once every field of its report has been found")
+    parser.add_argument("--timeout", type=float, default=file_timeout, metavar="SECONDS",
+                        help="Give up on a PDF after SECONDS, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--memory-limit", type=int, default=file_memory_limit // (1024 * 1024), metavar="MB",
+                        help="Memory a worker may use to parse a PDF in MB, 0 for no limit (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    print_header()
+
+    cache = None if args.no_cache else ExtractionCache(cache_folder, cache_size_limit)
+    settings = default_settings._replace(backend=args.backend, early_exit=args.early_exit)
+    limits = FileLimits(timeout=args.timeout, memory=args.memory_limit * 1024 * 1024)
+    regions = {region.name: region for region in load_regions(args.config)} if os.path.exists(args.config) else {}
+
+    service = ExtractionService(args.workers, args.max_concurrent, cache, settings, limits, regions)
+    server = ThreadingHTTPServer((args.host, args.port), ServiceHandler)
+    server.service = service
+    print("Serving on http://{}:{} with {} workers".format(args.host, server.server_port, args.workers))
+    signal.signal(signal.SIGTERM, stop_service)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+    print("\nComplete!")
+
+
+# Stop serve on SIGTERM as on Ctrl-C
+def stop_service(signum, frame):
+    raise KeyboardInterrupt
+
+
+# Shard from the Command Line
+def parse_shard(value):
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected i/N, for example 1/4")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("shard {} is not between 1 and {}".format(index, count))
+
+    return Shard(index, count)
+
+
+# Page Limits from the Command Line
+def parse_max_pages(values):
+    max_pages = dict(report_max_pages)
+    for value in values:
+        report_types = list(max_pages)
+        limit = value
+        if "=" in value:
+            report_type, limit = value.split("=", 1)
+            if report_type not in max_pages:
+                raise SystemExit("Unknown report type for --max-pages: {}".format(report_type))
+            report_types = [report_type]
+
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = -1
+        if limit < 0:
+            raise SystemExit("--max-pages expects a number of pages (0 for all of them): {}".format(value))
+
+        for report_type in report_types:
+            max_pages[report_type] = limit
+
+    return max_pages
+
+
+# Load the Regions from the Config File
+# NOTE: Folders are relative to the config file, the report type defaults to the one named after the region
+def load_regions(config_file):
+    try:
+        with open(config_file, "r") as config:
+            contents = json.load(config)
+    except OSError as e:
+        raise SystemExit("Could not read the region config: {}".format(e))
+    except ValueError as e:
+        raise SystemExit("Region config {} is not valid JSON: {}".format(config_file, e))
+
+    config_dir = os.path.dirname(os.path.abspath(config_file))
+    regions = []
+    for region in contents.get("regions", []):
+        report_type = region.get("report_type", get_report_type(region["name"]))
+        if report_type not in report_fields:
+            raise SystemExit("Unknown report type {} for region {}".format(report_type, region["name"]))
+        regions.append(Region(region["name"], os.path.join(config_dir, region["folder"]), report_type))
+
+    return regions
+
+
 # Print the Header
 def print_header():
     print("-----------------------------")
@@ -54,392 +377,980 @@ def print_header():
 
 
 # Column Header for CSV Export
-def get_column_headers(folder):
-    if os.path.basename(folder) == "national":
-        return [["University", "Rank", "USN Score", "Grad Rate Percentage",
-                 "Predicted Grad Rate", "OverUnder Performance",
-                 "Alumni Giving Percentage", "Alumni Giving Rank",
-                 "Alumni Giving Rate", "Grad Retention Rate",
-                 "Grad Retention Rank", "6 Year Grad Rate",
-                 "Avg Freshman Retention Rate", "Undergrad Academic Rep",
-                 "Peer Assessment Score", "HS Counselor Score",
-                 "Faculty Resources Percentage", "Faculty Resources Rank",
-                 "Full-Time Faculty Percentage", "Full-Time PhD Terminal Percentage",
-                 "Classes Fewer than 20", "Classes More than 50",
-                 "Student Faculty Ratio", "Student Selectivity Percentage",
-                 "Student Selectivity Rank", "SAT/ACT Percentage",
-                 "Freshmen in Top 10 of HS", "Freshmen in Top 25 of HS",
-                 "Fall 2016 Acceptance Rate", "Financial Resources Percentage",
-                 "Financial Resources Rank"]]
-
-    elif os.path.basename(folder) == "north" or "south" or "midwest" or "west":
-        return [["University", "Rank", "USN Score", "Grad Rate %",
-                 "Grad Rate Rank", "Avg 6 Year Grade Percentage",
-                 "6 Year Grad with Pell Grant",
-                 "6 Year Grad No Pell Grant Percentage",
-                 "Diff between Pell and No Pell Percentage",
-                 "Avg First-Year Stud Retention Percentage",
-                 "Grad Rate Performance Percentage", "Predicted Grad Rate Percentage",
-                 "Over/Under Performance", "Expert Opinion Percentage",
-                 "Peer Assessment Score", "HS Counselor Score",
-                 "Faculty Resources Percentage", "Faculty Resources Rank",
-                 "Full-Time Faculty Percentage", "Full-Time PhD Terminal Percentage",
-                 "Classes Fewer than 20", "Class More than 50",
-                 "Student Faculty Ratio", "Student Excellence Percentage",
-                 "Student Excellence Rank", "SAT/ACT Percentage",
-                 "Freshmen in Top 10% of HS", "Freshmen in Top 25% of HS",
-                 "Financial Resources Percentage", "Financial Resources Rank",
-                 "Alumni Giving Percentage", "Alumni Giving Rank",
-                 "Avg Alumni Giving Percentage"]]
+def get_column_headers(report_type):
+    fields = report_fields[report_type]
+    return [[header for field in fields for header in field.headers]]
+
+
+# Column Types for Typed Exports
+# NOTE: Names, SAT/ACT ranges and ratios stay strings, ranks are ints and every other value
+#       (percentages, scores, over/under performance) is a float
+def get_column_types(report_type):
+    types = []
+    for header in get_column_headers(report_type)[0]:
+        if header == "University" or "SAT/ACT" in header or "Ratio" in header:
+            types.append("string")
+        elif "Rank" in header:
+            types.append("int")
+        else:
+            types.append("float")
+
+    return types
+
+
+# Convert an Extracted Value to its Column Type
+# NOTE: Values that are not numbers (for example N/A) become empty instead of failing the export
+def convert_value(value, column_type):
+    if value is None:
+        return None
+    elif column_type == "string":
+        return str(value).strip()
+
+    try:
+        number = float(str(value).strip().rstrip("%").replace(",", ""))
+    except ValueError:
+        return None
+
+    if column_type == "int":
+        return int(number) if number.is_integer() else None
+
+    return number
+
+
+# Search Through All Regions
+# NOTE: With more than one worker the changed PDFs of every region are queued on one process
+#       pool up front, rows are still written back in listing order so the CSVs match a serial run.
+#       A serial run reads the changed PDFs ahead of the parser instead, the workers already
+#       overlap their reads with each other's parsing
+def search_through_regions(regions, workers=1, cache=None, full=False, settings=default_settings, stats=None,
+                           export_format="csv", store=None, prefetch=prefetch_depth, prefetch_size=prefetch_budget,
+                           shard=None, limits=default_limits):
+    if stats is None:
+        stats = RunStats()
+
+    log_dir = log_folder if shard is None else get_shard_folder(log_folder, shard)
+    os.makedirs(log_dir, exist_ok=True)
+    error_log = ErrorLog(log_dir)
+
+    manifests = []
+    for region in regions:
+        try:
+            with stats.time_stage("discovery"):
+                manifests.append(plan_export(region, full, settings, export_format, shard, error_log))
+        except Exception as e:
+            print("Issue with reading file: {}".format(e))
+
+    pool = None
+    prefetcher = None
+    if workers > 1 or limits.timeout or limits.memory:
+        pool = WorkerPool(workers, cache, settings, limits)
+        for manifest in manifests:
+            manifest.submit(pool)
+    elif prefetch > 0:
+        prefetcher = PdfPrefetcher([pdf_file for manifest in manifests if manifest.changed
+                                    for pdf_file in manifest.pdf_files if pdf_file not in manifest.unchanged],
+                                   prefetch, prefetch_size)
+
+    try:
+        for manifest in manifests:
+            if not manifest.changed:
+                print("{} is up to date".format(os.path.basename(manifest.export_file)))
+                manifest.save()
+                sync_store(store, manifest, stats, shard)
+                continue
+
+            export = None
+            try:
+                export = open_export(manifest.export_dir, manifest.region, export_format)
+                search_through_files(manifest, export, cache, settings, stats, prefetcher, error_log)
+            except Exception as e:
+                print("Issue with reading file: {}".format(e))
+            finally:
+                if export is not None:
+                    with stats.time_stage("write"):
+                        export.close()
+                manifest.save()
+                sync_store(store, manifest, stats, shard)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if prefetcher is not None:
+            prefetcher.close()
+        error_log.close()
+
+
+# Bring the SQLite Store in Line with a Region's Manifest
+# NOTE: A shard's manifest only holds its own PDFs, so only rows of PDFs in the shard are removed
+def sync_store(store, manifest, stats, shard=None):
+    if store is None:
+        return
+
+    try:
+        with stats.time_stage("write"):
+            store.sync(manifest.region, manifest.written, manifest.signature, shard)
+    except sqlite3.Error as e:
+        print("Could not update the SQLite store: {}".format(e))
+
+
+# Work Out which PDFs in a Region Changed since the Last Export
+def plan_export(region, full=False, settings=default_settings, export_format="csv", shard=None, error_log=None):
+    export_dir = export_folder
+    if shard is not None:
+        export_dir = get_shard_folder(export_folder, shard)
+        os.makedirs(export_dir, exist_ok=True)
+
+    manifest = ExportManifest(export_dir, region, extractor_signature(settings), full, export_format)
+    skipped = []
+    pdf_files = find_pdf_files(region.folder, skipped)
+    if error_log is not None:
+        for skipped_file in skipped:
+            error_log.record(region, skipped_file, "skipped")
+
+    if shard is not None:
+        pdf_files = [pdf_file for pdf_file in pdf_files if in_shard(region, manifest.get_name(pdf_file), shard)]
+    manifest.plan(pdf_files)
+
+    return manifest
+
+
+# Folder of a Shard's Partial Outputs
+def get_shard_folder(folder, shard):
+    return os.path.join(folder, "shard-{}-of-{}".format(shard.index, shard.count))
+
+
+# Whether a PDF Belongs to a Shard
+# NOTE: Hashes the region name and the PDF's path inside the region folder, so every machine
+#       splits the PDFs the same way wherever the folders are mounted
+def in_shard(region, name, shard):
+    digest = hashlib.sha256("{}/{}".format(region.name, name).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard.count == shard.index - 1
+
+
+# Combine the Partial Outputs of Every Shard into the Exports
+# NOTE: Rows are taken from the shard manifests and written in the order a single run lists the
+#       PDFs in (name order, folder by folder). The merged manifest lets later unsharded runs
+#       carry on incrementally. The shards have to be run with the same --format as the merge
+def merge_shards(regions, count, export_format="csv"):
+    for region in regions:
+        entries = {}
+        signatures = set()
+        for index in range(1, count + 1):
+            manifest_file = get_manifest_file(get_shard_folder(export_folder, Shard(index, count)), region,
+                                              export_format)
+            try:
+                with open(manifest_file, "r") as manifest:
+                    contents = json.load(manifest)
+            except (OSError, ValueError) as e:
+                raise SystemExit("Shard {}/{} has no usable manifest for {}: {}".format(index, count, region.name, e))
+            signatures.add(contents.get("extractor"))
+            entries.update(contents.get("files", {}))
+
+        if len(signatures) > 1:
+            raise SystemExit("The shards of {} were run with different extraction settings".format(region.name))
+
+        manifest = ExportManifest(export_folder, region, signatures.pop(), True, export_format)
+        with open_export(export_folder, region, export_format) as export:
+            for name in sorted(entries, key=lambda name: name.split("/")):
+                export.write_rows(entries[name]["values"])
+                manifest.written[name] = entries[name]
+        manifest.save()
+
+        print("Merged {} files from {} shards into {}".format(len(entries), count,
+                                                               os.path.basename(manifest.export_file)))
 
 
 # Search Through PDF Files
-def search_through_files(folder):
-    # Get PDF Items
-    items = os.listdir(folder)
+def search_through_files(manifest, export, cache=None, settings=default_settings, stats=None, prefetcher=None,
+                         error_log=None):
+    if stats is None:
+        stats = RunStats()
+
+    for full_item in manifest.pdf_files:
+        if full_item in manifest.unchanged:
+            with stats.time_stage("write"):
+                export.write_rows(manifest.unchanged[full_item]["values"])
+            manifest.record(full_item)
+            stats.unchanged += 1
+            continue
+
+        item = os.path.basename(full_item)
+        print("Opening File {}.pdf...".format(item[:item.find(" _")]))
+        pdf_parser(full_item, export, manifest, cache, settings, stats, prefetcher, error_log)
+        print("Closing File {}.pdf...".format(item[:item.find(" _")]))
 
-    # Log Locker
-    log_lock = True
+
+# Find the Rankings Indicators PDFs under a Folder
+# NOTE: Sub-folders are searched too. os.scandir entries already know whether they are folders,
+#       so no stat call is made per entry. Entries are taken in name order to keep the listing stable.
+#       Every other file is added to skipped
+def find_pdf_files(folder, skipped, pdf_files=None):
+    if pdf_files is None:
+        pdf_files = []
+
+    # Get PDF Items
+    with os.scandir(folder) as items:
+        items = sorted(items, key=lambda entry: entry.name)
 
     for item in items:
 
-        if item.__contains__("Rankings Indicators") and item.__contains__(".pdf"):
-            full_item = os.path.join(folder, item)
+        if item.is_dir(follow_symlinks=False):
+            find_pdf_files(item.path, skipped, pdf_files)
+        elif item.name.__contains__("Rankings Indicators") and item.name.__contains__(".pdf"):
+            pdf_files.append(item.path)
         else:
-            print("Passed {}".format(item))
-            print("FOLDER!!!" + folder)
-            log_lock = export_to_log(log_folder, item, log_lock, folder)
-            continue
+            print("Passed {}".format(item.path))
+            skipped.append(item.path)
 
-        if os.path.isdir(full_item):
-            continue
-        else:
-            print("Opening File {}.pdf...".format(item[:item.find(" _")]))
-            pdf_parser(full_item)
-        print("Closing File {}.pdf...".format(item[:item.find(" _")]))
+    return pdf_files
 
 
 # Parse the PDFs to be Human Readable
+# NOTE: Picks up the row from the process pool when the file was queued on one
+# NOTE: A file that fails or runs out of time is logged and left out of the export and the manifest,
+#       so the rest of the region carries on and the file is tried again on the next run
+def pdf_parser(pdf_file, export, manifest, cache=None, settings=default_settings, stats=None, prefetcher=None,
+               error_log=None):
+    try:
+        if manifest.pool is not None and pdf_file in manifest.pool:
+            values, file_stats = manifest.pool.result(pdf_file)
+        else:
+            data = prefetcher.get(pdf_file) if prefetcher is not None else None
+            values, file_stats = timed_extract_values(pdf_file, manifest.region.report_type, cache, settings, data)
+    except Exception as e:
+        status = "timeout" if isinstance(e, ParseTimeout) else "failed"
+        print("Could not parse {} ({}): {}".format(os.path.basename(pdf_file), status, e))
+        if stats is not None:
+            stats.failed += 1
+        if error_log is not None:
+            error_log.record(manifest.region, pdf_file, status, e)
+        return
+
+    print("Gathering values...")
+    print("Exporting to CSV...")
+    if stats is not None:
+        stats.add_file(manifest.region.name, manifest.get_name(pdf_file), file_stats)
+        with stats.time_stage("write"):
+            export.write_rows(values)
+    else:
+        export.write_rows(values)
+    manifest.record(pdf_file, values, file_stats["hash"])
+
+
+# Raised when a PDF Runs out of Time
+class ParseTimeout(Exception):
+    pass
+
+
+def raise_timeout(signum, frame):
+    raise ParseTimeout("no result after the time limit")
+
+
+# Set up a Worker Process
+# NOTE: The memory limit caps the worker's data segment, a PDF that needs more fails with a
+#       MemoryError instead of growing the worker until the machine runs out
+def init_worker(memory_limit=0):
+    if memory_limit and resource is not None:
+        soft, hard = resource.getrlimit(resource.RLIMIT_DATA)
+        if hard != resource.RLIM_INFINITY:
+            memory_limit = min(memory_limit, hard)
+        resource.setrlimit(resource.RLIMIT_DATA, (memory_limit, hard))
+
+
+# Process Pool that Outlives a Dying Worker
+# NOTE: A worker killed mid-file (out of memory, a crash in native code) breaks the whole pool. The
+#       file being read back is then parsed again on its own in a fresh worker, so only the file at
+#       fault fails, and every file still outstanding is queued again on a new pool
+class WorkerPool:
+    def __init__(self, workers, cache=None, settings=default_settings, limits=default_limits):
+        self.workers = workers
+        self.cache = cache
+        self.settings = settings
+        self.limits = limits
+        self.queued = {}
+        self.futures = {}
+        self.executor = self.start(workers)
+
+    def __contains__(self, pdf_file):
+        return pdf_file in self.futures
+
+    def start(self, workers):
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(self.limits.memory,))
+
+    def submit(self, pdf_file, report_type):
+        self.queued[pdf_file] = report_type
+        self.futures[pdf_file] = self.executor.submit(
+            limited_extract_values, pdf_file, report_type, self.cache, self.settings, self.limits.timeout)
+
+    # Values and Timings of a Queued File
+    def result(self, pdf_file):
+        future = self.futures.pop(pdf_file)
+        report_type = self.queued.pop(pdf_file)
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            print("A worker died, parsing {} on its own".format(os.path.basename(pdf_file)))
+
+        self.executor.shutdown(cancel_futures=True)
+        single = self.start(1)
+        try:
+            return single.submit(limited_extract_values, pdf_file, report_type, self.cache, self.settings,
+                                 self.limits.timeout).result()
+        finally:
+            single.shutdown()
+            self.executor = self.start(self.workers)
+            for queued_file, queued_type in list(self.queued.items()):
+                self.submit(queued_file, queued_type)
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+# Extract the CSV Row from a PDF within the Time Limit
+# NOTE: Runs in a worker process, SIGALRM interrupts the parser wherever it is once the time is up.
+#       Where there is no SIGALRM (Windows) the time limit is not enforced
+def limited_extract_values(pdf_file, report_type, cache=None, settings=default_settings, timeout=0, data=None):
+    if not timeout or not hasattr(signal, "SIGALRM"):
+        return timed_extract_values(pdf_file, report_type, cache, settings, data)
+
+    previous = signal.signal(signal.SIGALRM, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return timed_extract_values(pdf_file, report_type, cache, settings, data)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+# Extract the CSV Row from a PDF and Time its Stages
+def timed_extract_values(pdf_file, report_type, cache=None, settings=default_settings, data=None):
+    file_stats = {"cached": False, "pages": 0, "open": 0.0, "render": 0.0, "retrieve": 0.0}
+    started = time.perf_counter()
+    values = extract_values(pdf_file, report_type, cache, settings, file_stats, data)
+    file_stats["total"] = time.perf_counter() - started
+
+    return values, file_stats
+
+
+# Extract the CSV Row from a PDF
+# NOTE: Runs inside the worker processes in parallel mode, so it must not write any output
+# NOTE: data holds the contents of the PDF when they were already read ahead. Otherwise the file
+#       is read here in one go, so it is only read once for its hash and its pages. The hash is
+#       handed back in file_stats for the manifest
+def extract_values(pdf_file, report_type, cache=None, settings=default_settings, file_stats=None, data=None):
+    if data is None:
+        data = read_file(pdf_file)
+    content_digest = hashlib.sha256(data).hexdigest()
+    if file_stats is not None:
+        file_stats["hash"] = content_digest
+
+    # Unchanged PDFs are Served from the Cache
+    if cache is not None:
+        key = cache.key(content_digest, report_type, extractor_signature(settings))
+        values = cache.get(key)
+        if values is not None:
+            if file_stats is not None:
+                file_stats["cached"] = True
+            return values
+
+    with io.BytesIO(data) as fp:
+        values = parse_pdf(fp, report_type, settings, file_stats)
+
+    if cache is not None:
+        cache.put(key, values)
+
+    return values
+
+
+# Read-Ahead of the PDFs to Parse
+# NOTE: Reads the next files on a thread pool while the current one is parsed, so slow storage is
+#       waited on in the background. Files are expected in the order they were given, skipping some
+#       drops their buffers. At most depth files totalling budget bytes are held, bigger files are
+#       left to be read by the parser
+class PdfPrefetcher:
+    def __init__(self, pdf_files, depth=prefetch_depth, budget=prefetch_budget):
+        self.pending = deque(pdf_files)
+        self.depth = depth
+        self.budget = budget
+        self.buffered = 0
+        self.queued = {}
+        self.executor = ThreadPoolExecutor(max_workers=depth)
+        self.fill()
+
+    # Queue Reads until the Depth or the Budget is Reached
+    def fill(self):
+        while self.pending and len(self.queued) < self.depth:
+            pdf_file = self.pending[0]
+            try:
+                size = os.path.getsize(pdf_file)
+            except OSError:
+                self.pending.popleft()
+                continue
+
+            if size > self.budget:
+                self.pending.popleft()
+                continue
+            elif self.buffered + size > self.budget:
+                break
+
+            self.pending.popleft()
+            self.buffered += size
+            self.queued[pdf_file] = (size, self.executor.submit(read_file, pdf_file))
+
+    # Contents of a PDF, or None when it was not read ahead
+    def get(self, pdf_file):
+        data = None
+        if pdf_file in self.queued:
+            while self.queued:
+                queued_file = next(iter(self.queued))
+                size, future = self.queued.pop(queued_file)
+                self.buffered -= size
+                if queued_file == pdf_file:
+                    try:
+                        data = future.result()
+                    except OSError:
+                        data = None
+                    break
+                future.cancel()
+        elif pdf_file in self.pending:
+            for size, future in self.queued.values():
+                future.cancel()
+            self.queued = {}
+            self.buffered = 0
+            while self.pending.popleft() != pdf_file:
+                pass
+
+        self.fill()
+        return data
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        self.queued = {}
+        self.pending.clear()
+
+
+# Read a Whole File
+def read_file(path):
+    with open(path, "rb") as fp:
+        return fp.read()
+
+
+# Render the PDF to Text and Retrieve the Values
+# NOTE: Pages are rendered one at a time and their lines matched as they come, only the text of
+#       the current page is held in memory
+# NOTE: Time not spent opening the PDF or rendering its pages is counted as retrieving the values
+def parse_pdf(fp, report_type, settings=default_settings, file_stats=None):
+    backend = get_backend(settings.backend)
+    started = time.perf_counter()
+
+    with closing(backend.render_pages(fp, settings.max_pages.get(report_type, 0), file_stats,
+                                      get_field_matcher(report_type))) as pages:
+        values = build_values(iter_field_events(pages, report_type, settings.early_exit), report_type)
+
+    if file_stats is not None:
+        file_stats["retrieve"] = time.perf_counter() - started - file_stats["open"] - file_stats["render"]
+
+    return values
+
+
+# Text Extraction with pdfminer's Full Layout Analysis
 # NOTE: Credit to https://stackoverflow.com/questions/25665/python-module-for-converting-pdf-to-text
-def pdf_parser(pdf_file):
-    fp = open(pdf_file, 'rb')
-    rsrcmgr = PDFResourceManager()
-    retstr = io.StringIO()
-    codec = 'utf-8'
-    laparams = LAParams()
-    device = TextConverter(rsrcmgr, retstr, codec=codec, laparams=laparams)
+# NOTE: The text buffer is emptied after every page so the pages are only copied out once
+# NOTE: One backend is kept per process (see get_backend). Its resource manager, device and
+#       interpreter are reused for every PDF, so fonts are only decoded again for a PDF that
+#       brings new ones. A backend renders one PDF at a time
+class PdfminerBackend:
+    def __init__(self):
+        self.rsrcmgr = SharedResourceManager(font_cache_bytes)
+        self.device = self.get_device()
 
-    # Create a PDF interpreter object.
-    interpreter = PDFPageInterpreter(rsrcmgr, device)
+        # Create a PDF interpreter object.
+        self.interpreter = PDFPageInterpreter(self.rsrcmgr, self.device)
 
-    # Process each page contained in the document.
-    for page in PDFPage.get_pages(fp):
-        interpreter.process_page(page)
-        data = retstr.getvalue()
+    def get_laparams(self):
+        return LAParams()
 
-    # Retrieve Values from PDF
-    values = retrieve_values(data, os.path.basename(os.path.dirname(pdf_file)))
+    def get_device(self):
+        self.retstr = io.StringIO()
+        return TextConverter(self.rsrcmgr, self.retstr, codec='utf-8', laparams=self.get_laparams())
 
-    print("Exporting to CSV...")
-    export_to_csv(export_folder, values, "a", os.path.dirname(pdf_file))
+    # Forget what is Left of the Last PDF
+    def reset(self):
+        self.rsrcmgr.reset()
+        self.device.pageno = 1
+        self.retstr.seek(0)
+        self.retstr.truncate(0)
 
-    # close file
-    fp.close()
+    # Lines of the Page just Rendered
+    def get_lines(self, matcher=None):
+        lines = self.retstr.getvalue().splitlines()
+        self.retstr.seek(0)
+        self.retstr.truncate(0)
+        return lines
 
+    # Render the PDF a Page at a Time
+    # NOTE: Yields the lines of each page. Fills in the open and render times and the page count
+    #       of file_stats when given, matcher holds the field labels of the report being read
+    def render_pages(self, fp, maxpages=0, file_stats=None, matcher=None):
+        if file_stats is None:
+            file_stats = {"pages": 0, "open": 0.0, "render": 0.0}
 
-# Retrieve all values from the PDF
-def retrieve_values(data, dir_name):
-    # Variables
-    global school_name, school_rank, usn_score, grad_rate_perf, \
-        predict_grad_rate, over_under_perf, alum_giving, alum_give_rank, \
-        avg_alum_give_rate, grad_and_ret_rates, grad_and_ret_rank, \
-        six_year_grade_rate, avg_fresh_ret_rate, undergrad_acad_rep, \
-        peer_assess_score, hs_coun_score, fac_res, fac_res_rank, \
-        perc_fac_fulltime, fulltime_fac_phd_term_deg, classes_fewer_twenty, \
-        classes_fifty_more, stud_fac_ratio, stud_sel, stud_sel_rank, \
-        sat_act_perc, fresh_top_ten_hs, fresh_top_25_hs, fall_2016_acc_rate, \
-        fin_res, fin_res_rank, grad_ret_rate_perc, grad_ret_rank, \
-        avg_six_grad_rate, six_year_received_pell, six_year_no_pell, \
-        diff_pell_nonpell, avg_firstyear_ret_rate, pred_grad_rate, \
-        expert_opinion, stud_excel, stud_excel_rank
-
-    # Print
-    print("Gathering values...")
+        interpreter = self.interpreter
+        self.reset()
 
-    if dir_name == "national":
-
-        # For every line get values
-        for line in data.splitlines():
-
-            if line.find("is ranked") >= 0:
-                school_name = line[:line.find("is ranked")]
-                school_rank = line[line.find("#") + 1:line.find("in National")].rstrip()
-            elif line.find("Score:") >= 0:
-                usn_score = extract_score(line)
-            elif line.find("Graduation Rate Performance Rank") >= 0:
-                grad_rate_perf = line[line.find("(") + 1:line.find("%")]
-            elif line.find("Predicted graduation rate:") >= 0:
-                predict_grad_rate = line[line.find(":") + 2:line.find("%")]
-            elif line.find("Overperformance(+)/Underperformance(-)") >= 0:
-                if line.find("-") >= 0:
-                    over_under_perf = line[line.find(":") + 2:]
-                else:
-                    over_under_perf = extract_score(line)
-            elif line.find("Alumni Giving") >= 0:
-                alum_giving = line[line.find("(") + 1:line.find("%")]
-            elif line.find("Alumni giving rank:") >= 0:
-                alum_give_rank = extract_score(line)
-            elif line.find("Average alumni giving rate:") >= 0:
-                if line.find("]") >= 0:
-                    avg_alum_give_rate = line[line.find("]") + 2:line.find("%")]
-                elif line.find("%") >= 0:
-                    avg_alum_give_rate = line[line.find(":") + 2:line.find("%")]
-                else:
-                    avg_alum_give_rate = line[line.find(":") + 2:]
-            elif line.find("Graduation and Retention Rates") >= 0:
-                grad_and_ret_rates = line[line.find("(") + 1:line.find("%")]
-            elif line.find("Graduation and retention rank") >= 0:
-                grad_and_ret_rank = extract_score(line)
-            elif line.find("6-year graduation rate:") >= 0:
-                if line.find("]") >= 0:
-                    six_year_grade_rate = line[line.find("]") + 2:line.find("%")]
-                else:
-                    six_year_grade_rate = line[line.find(":") + 2:line.find("%")]
-            elif line.find("Average freshman retention rate:") >= 0:
-                if line.find("]") >= 0:
-                    avg_fresh_ret_rate = line[line.find("]") + 2:line.find("%")]
-                else:
-                    avg_fresh_ret_rate = line[line.find(":") + 2:line.find("%")]
-            elif line.find("Undergraduate Academic Reputation") >= 0:
-                undergrad_acad_rep = line[line.find("(") + 1:line.find("%")]
-            elif line.find("Peer assessment score (out of 5):") >= 0:
-                peer_assess_score = line[line.find(":") + 2:]
-            elif line.find("High school counselor score (out of 5):") >= 0:
-                hs_coun_score = line[line.find(":") + 2:]
-            elif line.find("Faculty Resources (") >= 0:
-                fac_res = line[line.find("(") + 1:line.find("%")]
-            elif line.find("Faculty Resources Rank:") >= 0:
-                fac_res_rank = extract_score(line)
-            elif line.find("Percent of faculty who are full-time:") >= 0:
-                if line.find("]") >= 0:
-                    perc_fac_fulltime = line[line.find("]") + 2:line.find("%")]
-                else:
-                    perc_fac_fulltime = line[line.find(":") + 2:line.find("%")]
-            elif line.find("Full-time faculty with Ph.D or terminal degree:") >= 0:
-                if line.find("%") >= 0:
-                    fulltime_fac_phd_term_deg = line[line.find(":") + 2:line.find("%")]
-                else:
-                    fulltime_fac_phd_term_deg = line[line.find(":") + 2:]
-            elif line.find("Classes with fewer than 20 students: ") >= 0:
-                if line.find("%") >= 0:
-                    classes_fewer_twenty = line[line.find(":") + 2:line.find("%")]
-                else:
-                    classes_fewer_twenty = line[line.find(":") + 2:line.find(":1")]
-            elif line.find("Classes with 50 or more students:") >= 0:
-                if line.find("]") >= 0:
-                    classes_fifty_more = line[line.find("]") + 2:line.find("%")]
-                else:
-                    classes_fifty_more = line[line.find(":") + 2:]
-            elif line.find("Student-faculty ratio:") >= 0:
-                if line.find("]") >= 0:
-                    stud_fac_ratio = line[line.find("]") + 2:]
-                elif line.find("/") >= 0:
-                    stud_fac_ratio = line[line.find(":") + 2:]
-                else:
-                    stud_fac_ratio = line[line.find(":") + 2:line.find(":1")]
-            elif line.find("Student Selectivity (") >= 0:
-                stud_sel = line[line.find("(") + 1:line.find("%")]
-            elif line.find("Student selectivity rank:") >= 0:
-                stud_sel_rank = extract_score(line)
-            elif line.find("SAT/ACT 25th-75th percentile:") >= 0:
-                if line.find("]") >= 0:
-                    sat_act_perc = line[line.find("]") + 2:]
-                else:
-                    sat_act_perc = line[line.find(":") + 2:]
-            elif line.find("Freshmen in top 10 percent of high school class:") >= 0:
-                if line.find("]") >= 0:
-                    fresh_top_ten_hs = line[line.find("]") + 2:line.find("%")]
-                elif line.find("%") >= 0:
-                    fresh_top_ten_hs = line[line.find(":") + 2:line.find("%")]
-                else:
-                    fresh_top_ten_hs = line[line.find(":") + 2:]
-            elif line.find("Freshmen in top 25 percent of high school class:") >= 0:
-                if line.find("]") >= 0:
-                    fresh_top_25_hs = line[line.find("]") + 2:line.find("%")]
-                elif line.find("%") >= 0:
-                    fresh_top_25_hs = line[line.find(":") + 2:line.find("%")]
-                else:
-                    fresh_top_25_hs = line[line.find(":") + 2:]
-            elif line.find("Fall 2016 acceptance rate:") >= 0:
-                if line.find("]") >= 0:
-                    fall_2016_acc_rate = line[line.find("]") + 2:line.find("%")]
-                else:
-                    fall_2016_acc_rate = line[line.find(":") + 2:line.find("%")]
-            elif line.find("Financial Resources (") >= 0:
-                fin_res = line[line.find("(") + 1:line.find("%")]
-            elif line.find("Financial resources rank:") >= 0:
-                fin_res_rank = extract_score(line)
-
-        # Putting values into a list of lists
-        # NOTE: Have to have them in this format for CSV to export correctly
-        values = [[school_name, school_rank, usn_score, grad_rate_perf,
-                   predict_grad_rate, over_under_perf, alum_giving, alum_give_rank,
-                   avg_alum_give_rate, grad_and_ret_rates, grad_and_ret_rank,
-                   six_year_grade_rate, avg_fresh_ret_rate, undergrad_acad_rep,
-                   peer_assess_score, hs_coun_score, fac_res, fac_res_rank,
-                   perc_fac_fulltime, fulltime_fac_phd_term_deg,
-                   classes_fewer_twenty, classes_fifty_more, stud_fac_ratio,
-                   stud_sel, stud_sel_rank, sat_act_perc, fresh_top_ten_hs,
-                   fresh_top_25_hs, fall_2016_acc_rate, fin_res, fin_res_rank]]
+        try:
+            pages = PDFPage.get_pages(fp, maxpages=maxpages)
+            while True:
+                # Opening the Document Happens on the First Page
+                started = time.perf_counter()
+                page = next(pages, None)
+                file_stats["open"] += time.perf_counter() - started
+                if page is None:
+                    break
 
-        return values
-    elif dir_name == "north" or "south" or "midwest" or "west":
-
-        # For every line get values
-        for line in data.splitlines():
-
-            if line.find("is ranked") >= 0:
-                school_name = line[:line.find("is ranked")]
-                school_rank = line[line.find("#") + 1:line.find("in Regional")].rstrip()
-            elif line.find("Score:") >= 0:
-                usn_score = extract_score(line)
-            elif line.find("Graduation and Retention Rates") >= 0:
-                grad_ret_rate_perc = line[line.find("(") + 1:line.find("%")]
-            elif line.find("Graduation and retention rank") >= 0:
-                grad_ret_rank = line[line.find(":") + 2:]
-            elif line.find("Average 6-year graduation rate") >= 0:
-                if line.find("]") >= 0:
-                    avg_six_grad_rate = line[line.find("]") + 2:line.find("%")]
-                elif line.find("%"):
-                    avg_six_grad_rate = line[line.find(":") + 2:line.find("%")]
-                else:
-                    avg_six_grad_rate = line[line.find(":") + 2:]
-            elif line.find("6-year graduation rate of students who received") >= 0:
-                if line.find("%") >= 0:
-                    six_year_received_pell = line[line.find(":") + 2:line.find("%")]
-                else:
-                    six_year_received_pell = line[line.find(":") + 2:]
-            elif line.find("6-year graduation rate of students who did not") >= 0:
-                if line.find("%") >= 0:
-                    six_year_no_pell = line[line.find(":") + 2:line.find("%")]
-                else:
-                    six_year_no_pell = line[line.find(":") + 2:]
-            elif line.find("Difference between graduation rates of Pell") >= 0:
-                if line.find("%") >= 0:
-                    diff_pell_nonpell = line[line.find(":") + 2:line.find("%")]
-                else:
-                    diff_pell_nonpell = line[line.find(":") + 2:]
-            elif line.find("student retention rate") >= 0:
-                if line.find("[") >= 0:
-                    avg_firstyear_ret_rate = line[line.find("]") + 2:line.find("%")]
-                elif line.find("%") >= 0:
-                    avg_firstyear_ret_rate = line[line.find(":") + 2:line.find("%")]
-                else:
-                    avg_firstyear_ret_rate = line[line.find(":") + 2:]
-            elif line.find("Graduation Rate Performance") >= 0:
-                grad_rate_perf = line[line.find("(") + 1:line.find("%")]
-            elif line.find("Predicted graduation rate") >= 0:
-                pred_grad_rate = line[line.find(":") + 2:line.find("%")]
-            elif line.find("Overperformance(+)/Underperformance(-)") >= 0:
-                over_under_perf = line[line.find(":") + 2:]
-            elif line.find("Expert Opinion") >= 0:
-                expert_opinion = line[line.find("(") + 2:line.find("%")]
-            elif line.find("Peer assessment score (out of 5)") >= 0:
-                peer_assess_score = line[line.find(":") + 2:]
-            elif line.find("High school counselor score") >= 0:
-                hs_coun_score = line[line.find(":") + 2:]
-            elif line.find("Faculty Resources (") >= 0:
-                fac_res = line[line.find("(") + 1:line.find("%")]
-            elif line.find("Faculty Resources Rank") >= 0:
-                fac_res_rank = line[line.find(":") + 2:]
-            elif line.find("of faculty who are full-time") >= 0:
-                if line.find("[") >= 0:
-                    perc_fac_fulltime = line[line.find("]") + 2:line.find("%")]
-                elif line.find("%") >= 0:
-                    perc_fac_fulltime = line[line.find(":") + 2:line.find("%")]
-                else:
-                    perc_fac_fulltime = line[line.find(":") + 2:]
-            elif line.find("Full-time faculty with Ph.D or terminal degree") >= 0:
-                if line.find("%") >= 0:
-                    fulltime_fac_phd_term_deg = line[line.find(":") + 2:line.find("%")]
-                else:
-                    fulltime_fac_phd_term_deg = line[line.find(":") + 2:]
-            elif line.find("Classes with fewer than 20 students") >= 0:
-                if line.find("[") >= 0:
-                    classes_fewer_twenty = line[line.find("]") + 2:line.find("%")]
-                elif line.find("%") >= 0:
-                    classes_fewer_twenty = line[line.find(":") + 2:line.find("%")]
-                else:
-                    classes_fewer_twenty = line[line.find(":") + 2:]
-            elif line.find("Classes with 50 or more students") >= 0:
-                if line.find("[") >= 0:
-                    classes_fifty_more = line[line.find("]") + 2:line.find("%")]
-                elif line.find("%") >= 0:
-                    classes_fifty_more = line[line.find(":") + 2:line.find("%")]
-                else:
-                    classes_fifty_more = line[line.find(":") + 2:]
-            elif line.find("Student-faculty ratio") >= 0:
-                if line.find("]") >= 0:
-                    stud_fac_ratio = line[line.find("]") + 2:]
-                elif line.find("/") >= 0:
-                    stud_fac_ratio = line[line.find(":") + 2:]
-                else:
-                    stud_fac_ratio = line[line.find(":") + 2:line.find(":1")]
-            elif line.find("Student Excellence (") >= 0:
-                stud_excel = line[line.find("(") + 1:line.find("%")]
-            elif line.find("Student excellence rank") >= 0:
-                stud_excel_rank = line[line.find(":") + 2:]
-            elif line.find("SAT/ACT 25th-75th") >= 0:
-                if line.find("[") >= 0:
-                    sat_act_perc = line[line.find("]") + 2:]
-                else:
-                    sat_act_perc = line[line.find(":") + 2:]
-            elif line.find("Freshmen in top 10 percent of high") >= 0:
-                if line.find("[") >= 0:
-                    fresh_top_ten_hs = line[line.find("]") + 2:line.find("%")]
-                elif line.find("%") >= 0:
-                    fresh_top_ten_hs = line[line.find(":") + 2:line.find("%")]
-                else:
-                    fresh_top_ten_hs = line[line.find(":") + 2:]
-            elif line.find("Freshmen in top 25 percent of high") >= 0:
-                if line.find("[") >= 0:
-                    fresh_top_25_hs = line[line.find("]") + 2:line.find("%")]
-                elif line.find("%") >= 0:
-                    fresh_top_25_hs = line[line.find(":") + 2:line.find("%")]
-                else:
-                    fresh_top_25_hs = line[line.find(":") + 2:]
-            elif line.find("Financial Resources (") >= 0:
-                fin_res = line[line.find("(") + 1:line.find("%")]
-            elif line.find("Financial resources rank") >= 0:
-                fin_res_rank = line[line.find(":") + 2:]
-            elif line.find("Alumni Giving (") >= 0:
-                alum_giving = line[line.find("(") + 1:line.find("%")]
-            elif line.find("Alumni giving rank") >= 0:
-                alum_give_rank = line[line.find(":") + 2:]
-            elif line.find("Average alumni giving rate") >= 0:
-                if line.find("[") >= 0:
-                    avg_alum_give_rate = line[line.find("]") + 2:line.find("%")]
-                elif line.find("%") >= 0:
-                    avg_alum_give_rate = line[line.find(":") + 2:line.find("%")]
+                # Building the Lines is Part of Rendering
+                started = time.perf_counter()
+                interpreter.process_page(page)
+                lines = self.get_lines(matcher)
+                file_stats["render"] += time.perf_counter() - started
+                file_stats["pages"] += 1
+
+                yield lines
+        finally:
+            self.reset()
+
+
+# Resource Manager Sharing Fonts across PDFs
+# NOTE: pdfminer caches fonts by object id, which only means something inside one PDF. Fonts are
+#       cached here by a fingerprint of their resolved spec instead, so the same font embedded in
+#       another report is found again. Fonts without a fingerprint are built every time
+# NOTE: A cached font is built from a detached copy of its spec (see detach_font_spec), so it holds
+#       no reference back to the PDF it came from and the document can be freed once it is parsed
+# NOTE: pdfminer asks for the fonts of every page, so within a PDF fonts are also kept by object id
+#       and only fingerprinted the first time. reset() forgets them before the next PDF
+class SharedResourceManager(PDFResourceManager):
+    def __init__(self, cache_bytes=font_cache_bytes):
+        super().__init__(caching=False)
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.fonts = OrderedDict()
+        self.document_fonts = {}
+
+    def reset(self):
+        self.document_fonts = {}
+
+    def get_font(self, objid, spec):
+        if objid and objid in self.document_fonts:
+            return self.document_fonts[objid]
+
+        font = self.get_shared_font(spec)
+        if objid:
+            self.document_fonts[objid] = font
+
+        return font
+
+    def get_shared_font(self, spec):
+        key = font_fingerprint(spec)
+        if key is None:
+            return super().get_font(None, spec)
+
+        cached = self.fonts.get(key)
+        if cached is not None:
+            self.fonts.move_to_end(key)
+            return cached[0]
+
+        spec = detach_font_spec(spec)
+        size = font_spec_size(spec)
+        font = super().get_font(None, spec)
+        if size > self.cache_bytes:
+            return font
+
+        self.fonts[key] = (font, size)
+        self.cached_bytes += size
+        while self.cached_bytes > self.cache_bytes:
+            _, (_, dropped) = self.fonts.popitem(last=False)
+            self.cached_bytes -= dropped
+
+        return font
+
+
+# Fingerprint of a Font Spec
+# NOTE: Hashes the spec with every reference resolved and every stream (font file, ToUnicode map,
+#       widths) by its bytes. Specs nested deeper than max_depth get no fingerprint
+def font_fingerprint(spec, max_depth=16):
+    digest = hashlib.sha256()
+    try:
+        add_to_fingerprint(digest, spec, max_depth)
+    except RecursionError:
+        return None
+
+    return digest.hexdigest()
+
+
+def add_to_fingerprint(digest, value, depth):
+    if depth < 0:
+        raise RecursionError("font spec nested too deep")
+
+    value = resolve1(value)
+    if isinstance(value, PDFStream):
+        digest.update(b"stream")
+        add_to_fingerprint(digest, value.attrs, depth - 1)
+        if value.rawdata is not None:
+            digest.update(b"raw" + hashlib.sha256(value.rawdata).digest())
+        else:
+            digest.update(b"data" + hashlib.sha256(value.data or b"").digest())
+    elif isinstance(value, dict):
+        digest.update(b"dict")
+        for key in sorted(value, key=str):
+            digest.update(repr(key).encode("utf-8"))
+            add_to_fingerprint(digest, value[key], depth - 1)
+        digest.update(b"end")
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"list")
+        for item in value:
+            add_to_fingerprint(digest, item, depth - 1)
+        digest.update(b"end")
+    elif isinstance(value, PSLiteral):
+        digest.update(b"/" + repr(value.name).encode("utf-8"))
+    else:
+        digest.update(repr(value).encode("utf-8"))
+
+
+# Copy of a Font Spec without References to its PDF
+# NOTE: Like pdfminer's resolve_all, but the spec is copied instead of resolved in place and
+#       streams are copied too. A stream of an encrypted PDF is deciphered here since its decipher
+#       callback belongs to the document. Only called for specs that got a fingerprint, so the
+#       nesting is already known to be within max_depth
+def detach_font_spec(value):
+    value = resolve1(value)
+    if isinstance(value, PDFStream):
+        attrs = detach_font_spec(value.attrs)
+        if value.rawdata is None:
+            stream = PDFStream(attrs, b"")
+            stream.data = value.data
+            return stream
+
+        rawdata = value.rawdata
+        if value.decipher:
+            rawdata = value.decipher(value.objid, value.genno, rawdata, value.attrs)
+        return PDFStream(attrs, rawdata)
+    elif isinstance(value, dict):
+        return {key: detach_font_spec(item) for key, item in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [detach_font_spec(item) for item in value]
+
+    return value
+
+
+# Estimated Bytes Held by a Detached Font Spec
+def font_spec_size(value):
+    if isinstance(value, PDFStream):
+        return len(value.rawdata or value.data or b"") + font_spec_size(value.attrs)
+    elif isinstance(value, dict):
+        return sys.getsizeof(value) + sum(font_spec_size(item) for item in value.values())
+    elif isinstance(value, list):
+        return sys.getsizeof(value) + sum(font_spec_size(item) for item in value)
+
+    return sys.getsizeof(value)
+
+
+# Text Extraction with Tuned Layout Analysis
+# NOTE: The reports are plain "Label: value" lines, so text boxes are ordered top to bottom and
+#       left to right (boxes_flow=None) instead of by pdfminer's hierarchical grouping of boxes.
+#       Run --check-backend fast before relying on it for a new corpus
+class FastPdfminerBackend(PdfminerBackend):
+    def get_laparams(self):
+        return LAParams(boxes_flow=None)
+
+
+# Text Extraction by Joining Rows
+# NOTE: Groups the characters of each page into lines and joins the lines sharing a row left to
+#       right, instead of flattening pdfminer's text boxes. A label and a value that ended up in
+#       different text boxes come out on one line. A row holding more than one label is split in
+#       front of each label, so fields printed side by side stay apart. The lines then go through
+#       the same field matcher and value rules as the other backends
+# NOTE: Characters inside figures (Form XObjects) are read too, as TextConverter does
+class LayoutBackend(PdfminerBackend):
+    def get_laparams(self):
+        return LAParams()
+
+    def get_device(self):
+        self.laparams = self.get_laparams()
+        return PDFPageAggregator(self.rsrcmgr, laparams=None)
+
+    def reset(self):
+        self.rsrcmgr.reset()
+        self.device.pageno = 1
+
+    def get_lines(self, matcher=None):
+        lines = []
+        for row in get_layout_rows(self.device.get_result(), self.laparams):
+            line = row[0]
+            for text in row[1:]:
+                if matcher is not None and matcher.match(text) is not None:
+                    lines.append(line)
+                    line = text
                 else:
-                    avg_alum_give_rate = line[line.find(":") + 2:]
-
-        values = [[school_name, school_rank, usn_score, grad_ret_rate_perc,
-                   grad_ret_rank, avg_six_grad_rate, six_year_received_pell,
-                   six_year_no_pell, diff_pell_nonpell,
-                   avg_firstyear_ret_rate, grad_rate_perf, pred_grad_rate,
-                   over_under_perf, expert_opinion, peer_assess_score,
-                   hs_coun_score, fac_res, fac_res_rank, perc_fac_fulltime,
-                   fulltime_fac_phd_term_deg, classes_fewer_twenty,
-                   classes_fifty_more, stud_fac_ratio,
-                   stud_excel, stud_excel_rank, sat_act_perc, fresh_top_ten_hs,
-                   fresh_top_25_hs, fin_res, fin_res_rank, alum_giving,
-                   alum_give_rank, avg_alum_give_rate
-                   ]]
+                    line = "{} {}".format(line.rstrip(), text.lstrip())
+            lines.append(line)
 
-        return values
+        return lines
+
+
+# Text of a Page Row by Row
+# NOTE: Rows run from the top of the page down, each holds the text of its lines from left to right.
+#       A line joins the row above when its middle is within half its height of the row's middle
+def get_layout_rows(page, laparams):
+    text_lines = []
+    for line in page.group_objects(laparams, get_layout_chars(page)):
+        line.analyze(laparams)
+        if line.get_text().strip():
+            text_lines.append(line)
+
+    text_lines.sort(key=lambda line: (-(line.y0 + line.y1), line.x0))
+
+    rows = []
+    row_middle = None
+    for line in text_lines:
+        middle = (line.y0 + line.y1) / 2
+        if rows and abs(row_middle - middle) <= line.height / 2:
+            rows[-1].append(line)
+        else:
+            rows.append([line])
+            row_middle = middle
+
+    return [[line.get_text().rstrip("\n") for line in sorted(row, key=lambda line: line.x0)] for row in rows]
+
+
+# Characters of a Page, including those inside Figures
+def get_layout_chars(items):
+    chars = []
+    for item in items:
+        if isinstance(item, LTChar):
+            chars.append(item)
+        elif isinstance(item, LTFigure):
+            chars.extend(get_layout_chars(item))
+
+    return chars
+
+
+# Check a Backend Gives the Same Rows as the Selected Backend
+def check_backend(regions, backend, workers=1, settings=default_settings):
+    candidate = settings._replace(backend=backend)
+
+    pdf_files = []
+    report_types = []
+    for region in regions:
+        try:
+            found = find_pdf_files(region.folder, [])
+            pdf_files.extend(found)
+            report_types.extend([region.report_type] * len(found))
+        except Exception as e:
+            print("Issue with reading file: {}".format(e))
+
+    executor = None
+    results = map(compare_backends, pdf_files, report_types, repeat(settings), repeat(candidate))
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(compare_backends, pdf_files, report_types, repeat(settings), repeat(candidate))
+
+    mismatches = 0
+    try:
+        for pdf_file, report_type, (expected, actual) in zip(pdf_files, report_types, results):
+            if expected == actual:
+                continue
+
+            mismatches += 1
+            headers = get_column_headers(report_type)[0]
+            print("Mismatch in {}".format(pdf_file))
+            for header, expected_value, actual_value in zip(headers, expected[0], actual[0]):
+                if expected_value != actual_value:
+                    print("    {}: {!r} != {!r}".format(header, expected_value, actual_value))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print("\n{} of {} files give the same rows with the {} backend".format(
+        len(pdf_files) - mismatches, len(pdf_files), backend))
+
+    return 1 if mismatches else 0
+
+
+# Rows of a PDF from Two Extraction Settings
+def compare_backends(pdf_file, report_type, expected, actual):
+    return (extract_values(pdf_file, report_type, None, expected),
+            extract_values(pdf_file, report_type, None, actual))
+
+
+# Report Type of a Region
+def get_report_type(name):
+    if name == "national":
+        return "national"
+
+    return "regional"
+
+
+# Retrieve all values from the PDF
+def retrieve_values(data, report_type):
+    return build_values(iter_field_events([data.splitlines()], report_type), report_type)
+
+
+# Match the Lines of Each Page to the Report's Fields
+# NOTE: Yields (field index, line) for every line holding a field. With early_exit it stops
+#       asking for pages once every field has been found, after finishing the current page
+def iter_field_events(pages, report_type, early_exit=False):
+    matcher = get_field_matcher(report_type)
+    remaining = set(range(len(matcher.fields)))
+
+    for page_lines in pages:
+        for line in page_lines:
+            index = matcher.match(line)
+            if index is not None:
+                remaining.discard(index)
+                yield index, line
+
+        if early_exit and not remaining:
+            return
+
+
+# Build the CSV Row from the Field Events
+def build_values(events, report_type):
+    matcher = get_field_matcher(report_type)
+    values = [None] * len(matcher.headers)
+
+    # NOTE: A field found on more than one line keeps the value of the last one
+    for index, line in events:
+        field = matcher.fields[index]
+        column = matcher.columns[index]
+        values[column:column + len(field.headers)] = field.rule(line)
+
+    # Putting values into a list of lists
+    # NOTE: Have to have them in this format for CSV to export correctly
+    return [values]
+
+
+# Single Pass Matcher over the Field Labels of a Report Type
+# NOTE: Every label is indexed by one of its inner words (a word with a space on both sides), which
+#       has to show up as a whole word of any line holding the label. A line is split into words once
+#       and only the labels indexed by those words, plus the few labels without an inner word, are
+#       looked for in it. The line belongs to the first field (in table order) whose label it contains
+class FieldMatcher:
+    def __init__(self, fields):
+        self.fields = fields
+        self.headers = [header for field in fields for header in field.headers]
+        self.labels = [field.label for field in fields]
+
+        # Column of the First Value of Each Field
+        self.columns = []
+        column = 0
+        for field in fields:
+            self.columns.append(column)
+            column += len(field.headers)
+
+        # Index the Labels by their Rarest Inner Word
+        inner_words = [set(word for word in label.split(" ")[1:-1] if word) for label in self.labels]
+        word_counts = {}
+        for words in inner_words:
+            for word in words:
+                word_counts[word] = word_counts.get(word, 0) + 1
+
+        self.word_index = {}
+        self.unindexed = []
+        for index, words in enumerate(inner_words):
+            if words:
+                word = min(words, key=lambda word: (word_counts[word], word))
+                self.word_index.setdefault(word, []).append(index)
+            else:
+                self.unindexed.append(index)
+
+    # Index of the Field a Line Belongs to
+    def match(self, line):
+        labels = self.labels
+        found = None
+        for index in self.unindexed:
+            if labels[index] in line:
+                found = index
+                break
+
+        for word in self.word_index.keys() & line.split():
+            for index in self.word_index[word]:
+                if (found is None or index < found) and labels[index] in line:
+                    found = index
+
+        return found
+
+
+# Compiled Matcher for a Report Type
+def get_field_matcher(report_type):
+    if report_type not in field_matchers:
+        field_matchers[report_type] = FieldMatcher(report_fields[report_type])
 
-    print("Done gathering...")
+    return field_matchers[report_type]
+
+
+# Value Rules
+# NOTE: Each rule slices the value(s) of a field out of the line holding its label
+# NOTE: The rules replaced an elif chain per report type. rules_check.py fuzzes them against those
+#       chains and lists the values that changed on purpose (see known_changes there)
+def value_ranked(line, suffix):
+    school_name = line[:line.find("is ranked")]
+    school_rank = line[line.find("#") + 1:line.find(suffix)].rstrip()
+    return school_name, school_rank
+
+
+def value_score(line):
+    return extract_score(line),
+
+
+# Label (NN%)
+def value_weight(line):
+    return line[line.find("(") + 1:line.find("%")],
+
+
+# Label: value
+def value_after_colon(line):
+    return line[line.find(":") + 2:],
+
+
+# Label: NN%
+def value_percent(line):
+    return line[line.find(":") + 2:line.find("%")],
+
+
+# Label: NN% or Label: value
+def value_percent_or_text(line):
+    if line.find("%") >= 0:
+        return value_percent(line)
+    return value_after_colon(line)
+
+
+# Label: [footnote] NN% or Label: NN%
+def value_footnoted_percent(line):
+    if line.find("]") >= 0:
+        return line[line.find("]") + 2:line.find("%")],
+    return value_percent(line)
+
+
+# Label: [footnote] NN%, Label: NN% or Label: value
+def value_footnoted_percent_or_text(line):
+    if line.find("]") >= 0:
+        return line[line.find("]") + 2:line.find("%")],
+    return value_percent_or_text(line)
+
+
+# Label: [footnote] value or Label: value
+def value_footnoted_text(line):
+    if line.find("]") >= 0:
+        return line[line.find("]") + 2:],
+    return value_after_colon(line)
+
+
+# Label: [footnote] N/N, Label: N/N or Label: N:1
+def value_ratio(line):
+    if line.find("]") >= 0:
+        return line[line.find("]") + 2:],
+    elif line.find("/") >= 0:
+        return value_after_colon(line)
+    return line[line.find(":") + 2:line.find(":1")],
 
 
 # Extract Score from PDF
@@ -450,42 +1361,832 @@ def extract_score(line):
             return int(s)
 
 
-# Export Values to CSV path
-def export_to_csv(export_dir, values, argument, folder):
-    # File
-    csv_file = export_dir + "\\" + os.path.basename(folder) + "Export.csv"
+# Field Tables
+# NOTE: One entry per field in CSV column order. The label marks the line holding the field,
+#       the rule slices its value(s) out of that line and the headers name the CSV column(s)
+ReportField = namedtuple("ReportField", ["headers", "label", "rule"])
+
+report_fields = {
+    "national": [
+        ReportField(("University", "Rank"), "is ranked", partial(value_ranked, suffix="in National")),
+        ReportField(("USN Score",), "Score:", value_score),
+        ReportField(("Grad Rate Percentage",), "Graduation Rate Performance Rank", value_weight),
+        ReportField(("Predicted Grad Rate",), "Predicted graduation rate:", value_percent),
+        ReportField(("OverUnder Performance",), "Overperformance(+)/Underperformance(-)", value_after_colon),
+        ReportField(("Alumni Giving Percentage",), "Alumni Giving", value_weight),
+        ReportField(("Alumni Giving Rank",), "Alumni giving rank:", value_score),
+        ReportField(("Alumni Giving Rate",), "Average alumni giving rate:", value_footnoted_percent_or_text),
+        ReportField(("Grad Retention Rate",), "Graduation and Retention Rates", value_weight),
+        ReportField(("Grad Retention Rank",), "Graduation and retention rank", value_score),
+        ReportField(("6 Year Grad Rate",), "6-year graduation rate:", value_footnoted_percent),
+        ReportField(("Avg Freshman Retention Rate",), "Average freshman retention rate:",
+                    value_footnoted_percent),
+        ReportField(("Undergrad Academic Rep",), "Undergraduate Academic Reputation", value_weight),
+        ReportField(("Peer Assessment Score",), "Peer assessment score (out of 5):", value_after_colon),
+        ReportField(("HS Counselor Score",), "High school counselor score (out of 5):", value_after_colon),
+        ReportField(("Faculty Resources Percentage",), "Faculty Resources (", value_weight),
+        ReportField(("Faculty Resources Rank",), "Faculty Resources Rank:", value_score),
+        ReportField(("Full-Time Faculty Percentage",), "Percent of faculty who are full-time:",
+                    value_footnoted_percent),
+        ReportField(("Full-Time PhD Terminal Percentage",), "Full-time faculty with Ph.D or terminal degree:",
+                    value_percent_or_text),
+        ReportField(("Classes Fewer than 20",), "Classes with fewer than 20 students: ", value_percent_or_text),
+        ReportField(("Classes More than 50",), "Classes with 50 or more students:",
+                    value_footnoted_percent_or_text),
+        ReportField(("Student Faculty Ratio",), "Student-faculty ratio:", value_ratio),
+        ReportField(("Student Selectivity Percentage",), "Student Selectivity (", value_weight),
+        ReportField(("Student Selectivity Rank",), "Student selectivity rank:", value_score),
+        ReportField(("SAT/ACT Percentage",), "SAT/ACT 25th-75th percentile:", value_footnoted_text),
+        ReportField(("Freshmen in Top 10 of HS",), "Freshmen in top 10 percent of high school class:",
+                    value_footnoted_percent_or_text),
+        ReportField(("Freshmen in Top 25 of HS",), "Freshmen in top 25 percent of high school class:",
+                    value_footnoted_percent_or_text),
+        ReportField(("Fall 2016 Acceptance Rate",), "Fall 2016 acceptance rate:", value_footnoted_percent),
+        ReportField(("Financial Resources Percentage",), "Financial Resources (", value_weight),
+        ReportField(("Financial Resources Rank",), "Financial resources rank:", value_score),
+    ],
+    "regional": [
+        ReportField(("University", "Rank"), "is ranked", partial(value_ranked, suffix="in Regional")),
+        ReportField(("USN Score",), "Score:", value_score),
+        ReportField(("Grad Rate %",), "Graduation and Retention Rates", value_weight),
+        ReportField(("Grad Rate Rank",), "Graduation and retention rank", value_after_colon),
+        ReportField(("Avg 6 Year Grade Percentage",), "Average 6-year graduation rate",
+                    value_footnoted_percent_or_text),
+        ReportField(("6 Year Grad with Pell Grant",), "6-year graduation rate of students who received",
+                    value_percent_or_text),
+        ReportField(("6 Year Grad No Pell Grant Percentage",), "6-year graduation rate of students who did not",
+                    value_percent_or_text),
+        ReportField(("Diff between Pell and No Pell Percentage",), "Difference between graduation rates of Pell",
+                    value_percent_or_text),
+        ReportField(("Avg First-Year Stud Retention Percentage",), "student retention rate",
+                    value_footnoted_percent_or_text),
+        ReportField(("Grad Rate Performance Percentage",), "Graduation Rate Performance", value_weight),
+        ReportField(("Predicted Grad Rate Percentage",), "Predicted graduation rate", value_percent),
+        ReportField(("Over/Under Performance",), "Overperformance(+)/Underperformance(-)", value_after_colon),
+        ReportField(("Expert Opinion Percentage",), "Expert Opinion", value_weight),
+        ReportField(("Peer Assessment Score",), "Peer assessment score (out of 5)", value_after_colon),
+        ReportField(("HS Counselor Score",), "High school counselor score", value_after_colon),
+        ReportField(("Faculty Resources Percentage",), "Faculty Resources (", value_weight),
+        ReportField(("Faculty Resources Rank",), "Faculty Resources Rank", value_after_colon),
+        ReportField(("Full-Time Faculty Percentage",), "of faculty who are full-time",
+                    value_footnoted_percent_or_text),
+        ReportField(("Full-Time PhD Terminal Percentage",), "Full-time faculty with Ph.D or terminal degree",
+                    value_percent_or_text),
+        ReportField(("Classes Fewer than 20",), "Classes with fewer than 20 students",
+                    value_footnoted_percent_or_text),
+        ReportField(("Class More than 50",), "Classes with 50 or more students", value_footnoted_percent_or_text),
+        ReportField(("Student Faculty Ratio",), "Student-faculty ratio", value_ratio),
+        ReportField(("Student Excellence Percentage",), "Student Excellence (", value_weight),
+        ReportField(("Student Excellence Rank",), "Student excellence rank", value_after_colon),
+        ReportField(("SAT/ACT Percentage",), "SAT/ACT 25th-75th", value_footnoted_text),
+        ReportField(("Freshmen in Top 10% of HS",), "Freshmen in top 10 percent of high",
+                    value_footnoted_percent_or_text),
+        ReportField(("Freshmen in Top 25% of HS",), "Freshmen in top 25 percent of high",
+                    value_footnoted_percent_or_text),
+        ReportField(("Financial Resources Percentage",), "Financial Resources (", value_weight),
+        ReportField(("Financial Resources Rank",), "Financial resources rank", value_after_colon),
+        ReportField(("Alumni Giving Percentage",), "Alumni Giving (", value_weight),
+        ReportField(("Alumni Giving Rank",), "Alumni giving rank", value_after_colon),
+        ReportField(("Avg Alumni Giving Percentage",), "Average alumni giving rate",
+                    value_footnoted_percent_or_text),
+    ],
+}
+
+# Compiled Matchers per Report Type
+field_matchers = {}
+
+# Text Extraction Backends
+# NOTE: A backend renders the PDF and yields the lines of each page in turn
+extraction_backends = {
+    "pdfminer": PdfminerBackend,
+    "fast": FastPdfminerBackend,
+    "layout": LayoutBackend,
+}
+
+# Backends of this Process by Name
+backends = {}
+
+
+# Long-Lived Backend of this Process
+# NOTE: Every worker process builds its own backends the first time it parses a PDF
+def get_backend(name):
+    if name not in backends:
+        backends[name] = extraction_backends[name]()
+
+    return backends[name]
+
+
+# Buffered Export Writer for a Region
+# NOTE: Keeps <region>Export.csv open for the whole run and writes rows in batches
+class ExportWriter:
+    def __init__(self, export_dir, region, batch_size=None):
+        self.export_file = get_export_file(export_dir, region, "csv")
+        self.batch_size = batch_size or export_batch_size
+        self.rows = []
+
+        # Write Column Headers
+        self.output = open(self.export_file, "w")
+        self.writer = csv.writer(self.output, lineterminator="\n")
+        self.write_rows(get_column_headers(region.report_type))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Queue Rows and Flush Once a Batch is Full
+    def write_rows(self, values):
+        self.rows.extend(values)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.writer.writerows(self.rows)
+        self.rows = []
+        self.output.flush()
+
+    def close(self):
+        if self.output.closed:
+            return
+        self.flush()
+        self.output.close()
+
+
+# Typed Columnar Export Writer for a Region
+# NOTE: Writes <region>Export.parquet, .arrow or .feather (the Arrow IPC file format) with the
+#       column types of get_column_types, each flushed batch becomes a row group or record batch
+class ColumnarWriter(ExportWriter):
+    arrow_types = {"string": "string", "int": "int64", "float": "float64"}
+
+    def __init__(self, export_dir, region, export_format, batch_size=None):
+        self.export_file = get_export_file(export_dir, region, export_format)
+        self.batch_size = batch_size or columnar_batch_size
+        self.rows = []
+        self.closed = False
+
+        headers = get_column_headers(region.report_type)[0]
+        self.types = get_column_types(region.report_type)
+        self.schema = pyarrow.schema([(header, self.arrow_types[column_type])
+                                      for header, column_type in zip(headers, self.types)])
+
+        if export_format == "parquet":
+            self.writer = pyarrow.parquet.ParquetWriter(self.export_file, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_file(self.export_file, self.schema)
+
+    def flush(self):
+        if not self.rows:
+            return
+
+        columns = [[convert_value(row[index], column_type) for row in self.rows]
+                   for index, column_type in enumerate(self.types)]
+        self.writer.write_table(pyarrow.Table.from_arrays(columns, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.writer.close()
+        self.closed = True
+
+
+# Open the Export Writer for a Format
+def open_export(export_dir, region, export_format="csv"):
+    if export_format == "csv":
+        return ExportWriter(export_dir, region)
+
+    return ColumnarWriter(export_dir, region, export_format)
+
+
+# Export File of a Region
+def get_export_file(export_dir, region, export_format="csv"):
+    return os.path.join(export_dir, "{}Export.{}".format(region.name, export_format))
+
+
+# Manifest (or Checkpoint) File of a Region's Export
+# NOTE: Every format keeps its own manifest since its export is written on its own, the CSV
+#       export keeps <region>Manifest.json and the others <region>Manifest.<format>.json
+def get_manifest_file(export_dir, region, export_format="csv", kind="Manifest"):
+    suffix = "" if export_format == "csv" else "." + export_format
+    return os.path.join(export_dir, "{}{}{}.json".format(region.name, kind, suffix))
+
+
+# Structured Log of the Files Skipped or Failed in a Run
+# NOTE: Writes one JSON line per file to errors.jsonl with the region, the path inside the region
+#       folder, the status (skipped, failed or timeout) and the error. The log is opened (and
+#       truncated) once the first file is logged, and flushed after every line. A run that logs
+#       nothing leaves it empty, so it never lists the files of an earlier run
+class ErrorLog:
+    def __init__(self, log_dir):
+        self.log_file = os.path.join(log_dir, "errors.jsonl")
+        self.logger = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, region, file, status, error=None):
+        if self.logger is None:
+            self.logger = open(self.log_file, "w")
 
-    # Write to File
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "region": region.name,
+            "file": os.path.relpath(file, region.folder).replace(os.sep, "/"),
+            "status": status,
+            "error": "{}: {}".format(type(error).__name__, error) if error is not None else None,
+        }
+        self.logger.write(json.dumps(entry) + "\n")
+        self.logger.flush()
+
+    def close(self):
+        if self.logger is None:
+            self.logger = open(self.log_file, "w")
+
+        self.logger.close()
+        self.logger = None
+
+
+# Manifest of the PDFs Behind a Region's Export
+# NOTE: Records the size, mtime, content hash and row of every PDF written to the region's export,
+#       so the next run only parses new or changed files and leaves an up to date export alone.
+#       Only rows that made it into the export are saved, a failed run is redone next time
+# NOTE: While a region is exported the rows written so far are checkpointed to <region>Checkpoint.json
+#       every checkpoint_interval seconds. A run that was killed picks them up like unchanged files
+#       (even with --full) and only parses the rest, the checkpoint is removed once the manifest is saved
+class ExportManifest:
+    def __init__(self, export_dir, region, signature, full=False, export_format="csv"):
+        self.region = region
+        self.signature = signature
+        self.export_dir = export_dir
+        self.manifest_file = get_manifest_file(export_dir, region, export_format)
+        self.checkpoint_file = get_manifest_file(export_dir, region, export_format, "Checkpoint")
+        self.export_file = get_export_file(export_dir, region, export_format)
+        self.entries = {} if full else self.load(self.manifest_file)
+        self.resumed = self.load(self.checkpoint_file)
+        self.checkpointed = time.monotonic()
+        self.written = {}
+        self.pdf_files = []
+        self.unchanged = {}
+        self.pool = None
+        self.changed = True
+
+    def load(self, manifest_file):
+        try:
+            with open(manifest_file, "r") as manifest:
+                contents = json.load(manifest)
+        except (OSError, ValueError):
+            return {}
+
+        if contents.get("extractor") != self.signature:
+            return {}
+
+        return contents.get("files", {})
+
+    # Sort the PDFs into Unchanged and New or Modified Files
+    def plan(self, pdf_files):
+        self.pdf_files = pdf_files
+
+        for pdf_file in pdf_files:
+            name = self.get_name(pdf_file)
+            entry = self.resumed.get(name, self.entries.get(name))
+            if entry is None:
+                continue
+
+            # Touched Files are Compared by Content
+            stat = os.stat(pdf_file)
+            if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+                if file_digest(pdf_file) != entry["hash"]:
+                    continue
+                entry = dict(entry, size=stat.st_size, mtime=stat.st_mtime_ns)
+
+            self.unchanged[pdf_file] = entry
+
+        names = set(self.get_name(pdf_file) for pdf_file in pdf_files)
+        deleted = set(self.entries) - names
+        self.changed = len(self.unchanged) < len(pdf_files) or len(deleted) > 0 or \
+            not os.path.exists(self.export_file) or len(self.resumed) > 0
+        if self.resumed:
+            print("Resuming {} from a checkpoint of {} files".format(self.region.name, len(self.resumed)))
+
+        if not self.changed:
+            for pdf_file in pdf_files:
+                self.record(pdf_file)
+
+    # Queue the New or Modified Files on a Worker Pool
+    def submit(self, pool):
+        if not self.changed:
+            return
+
+        self.pool = pool
+        for pdf_file in self.pdf_files:
+            if pdf_file not in self.unchanged:
+                pool.submit(pdf_file, self.region.report_type)
+
+    # Record a Row Written to the Export
+    # NOTE: content_digest is the hash taken when the PDF was parsed, the file is only hashed again without it
+    def record(self, pdf_file, values=None, content_digest=None):
+        entry = self.unchanged.get(pdf_file)
+        if entry is None:
+            stat = os.stat(pdf_file)
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns,
+                     "hash": content_digest or file_digest(pdf_file), "values": values}
+
+        self.written[self.get_name(pdf_file)] = entry
+
+        if time.monotonic() - self.checkpointed >= checkpoint_interval:
+            self.checkpoint()
+
+    # Path of a PDF Relative to the Region's Folder
+    def get_name(self, pdf_file):
+        return os.path.relpath(pdf_file, self.region.folder).replace(os.sep, "/")
+
+    def save(self):
+        if self.write(self.manifest_file) and os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+    # Save the Rows Written so far
+    def checkpoint(self):
+        self.write(self.checkpoint_file)
+        self.checkpointed = time.monotonic()
+
+    def write(self, manifest_file):
+        temp_file = manifest_file + ".tmp"
+        try:
+            with open(temp_file, "w") as manifest:
+                json.dump({"extractor": self.signature, "files": self.written}, manifest)
+            os.replace(temp_file, manifest_file)
+        except OSError as e:
+            print("Could not write the manifest: {}".format(e))
+            return False
+
+        return True
+
+
+# SQLite Store of the Extracted Rows
+# NOTE: One table per report type (national, regional) with region, source file and row number
+#       columns in front of the export columns, typed like the columnar exports. Rows are upserted
+#       per source file and only rewritten when the PDF's hash or the extractor signature changed,
+#       rows of PDFs that are gone from the region are deleted. Each region is synced in one transaction
+class RankingsStore:
+    sql_types = {"string": "TEXT", "int": "INTEGER", "float": "REAL"}
+    indexed_headers = ["University", "Rank", "USN Score"]
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.connection = sqlite3.connect(db_file)
+        for report_type in report_fields:
+            self.create_table(report_type)
+
+    def create_table(self, report_type):
+        headers = get_column_headers(report_type)[0]
+        types = get_column_types(report_type)
+        columns = ", ".join("{} {}".format(quote_identifier(header), self.sql_types[column_type])
+                            for header, column_type in zip(headers, types))
+
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS {} (region TEXT NOT NULL, source_file TEXT NOT NULL, "
+                "row INTEGER NOT NULL, hash TEXT NOT NULL, extractor TEXT, {}, "
+                "PRIMARY KEY (region, source_file, row))".format(report_type, columns))
+
+            # Stores Made before the Extractor was Recorded
+            existing = [column[1] for column in self.connection.execute("PRAGMA table_info({})".format(report_type))]
+            if "extractor" not in existing:
+                self.connection.execute("ALTER TABLE {} ADD COLUMN extractor TEXT".format(report_type))
+            for header in self.indexed_headers:
+                self.connection.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+                    quote_identifier("{}_{}".format(report_type, header.replace(" ", "_").lower())),
+                    report_type, quote_identifier(header)))
+
+    # Upsert the Rows of Every PDF in a Region
+    # NOTE: Rows of PDFs missing from entries are removed, only those in the shard when one is given
+    def sync(self, region, entries, signature, shard=None):
+        report_type = region.report_type
+        headers = get_column_headers(report_type)[0]
+        types = get_column_types(report_type)
+        columns = ", ".join(quote_identifier(header) for header in headers)
+        updates = ", ".join("{0} = excluded.{0}".format(quote_identifier(header)) for header in headers)
+        upsert = ("INSERT INTO {0} (region, source_file, row, hash, extractor, {1}) VALUES (?, ?, ?, ?, ?, {2}) "
+                  "ON CONFLICT (region, source_file, row) DO UPDATE SET hash = excluded.hash, "
+                  "extractor = excluded.extractor, {3} "
+                  "WHERE {0}.hash != excluded.hash OR {0}.extractor IS NOT excluded.extractor").format(
+                      report_type, columns, ", ".join("?" * len(headers)), updates)
+
+        rows = []
+        for name, entry in entries.items():
+            for row_number, values in enumerate(entry["values"] or []):
+                rows.append([region.name, name, row_number, entry["hash"], signature] +
+                            [convert_value(value, column_type) for value, column_type in zip(values, types)])
+
+        with self.connection:
+            stored = self.connection.execute("SELECT DISTINCT source_file FROM {} WHERE region = ?".format(
+                report_type), (region.name,)).fetchall()
+            removed = [(region.name, name) for (name,) in stored
+                       if name not in entries and (shard is None or in_shard(region, name, shard))]
+            self.connection.executemany("DELETE FROM {} WHERE region = ? AND source_file = ?".format(report_type),
+                                        removed)
+            self.connection.executemany(upsert, rows)
+
+    def close(self):
+        self.connection.close()
+
+
+# Quote a Column Name for SQLite
+def quote_identifier(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+# On-Disk Cache of Extracted Rows
+# NOTE: Keyed by the PDF's content hash, its report type and the extractor signature. Hits bump the
+#       entry's mtime so trim() can evict the least recently used entries past the size cap
+class ExtractionCache:
+    def __init__(self, folder, size_limit):
+        self.folder = folder
+        self.size_limit = size_limit
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def key(content_digest, report_type, signature):
+        key = "{}:{}:{}".format(content_digest, signature, report_type)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        entry = os.path.join(self.folder, key + ".json")
+        try:
+            with open(entry, "r") as cached:
+                values = json.load(cached)
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+        return values
+
+    def put(self, key, values):
+        entry = os.path.join(self.folder, key + ".json")
+        temp_entry = "{}.{}.tmp".format(entry, os.getpid())
+        try:
+            with open(temp_entry, "w") as cached:
+                json.dump(values, cached)
+            os.replace(temp_entry, entry)
+        except OSError as e:
+            print("Could not write to the cache: {}".format(e))
+
+    def clear(self):
+        for item in os.listdir(self.folder):
+            if item.endswith(".json"):
+                os.remove(os.path.join(self.folder, item))
+
+    # Evict the Least Recently Used Entries
+    def trim(self):
+        entries = []
+        total_size = 0
+        for item in os.listdir(self.folder):
+            if not item.endswith(".json"):
+                continue
+            stat = os.stat(os.path.join(self.folder, item))
+            entries.append((stat.st_mtime, stat.st_size, item))
+            total_size += stat.st_size
+
+        for mtime, size, item in sorted(entries):
+            if total_size <= self.size_limit:
+                break
+            os.remove(os.path.join(self.folder, item))
+            total_size -= size
+
+
+# Extraction Service behind serve
+# NOTE: Keeps a pool of worker processes whose backends are built up front, so a request only pays
+#       for parsing. PDFs are read by the request thread and sent to a worker as bytes, identical
+#       PDFs requested at the same time share one parse and the extraction cache answers repeats.
+#       A pool broken by a dying worker is replaced
+class ExtractionService:
+    def __init__(self, workers, max_concurrent, cache=None, settings=default_settings, limits=default_limits,
+                 regions=None):
+        self.workers = workers
+        self.cache = cache
+        self.settings = settings
+        self.limits = limits
+        self.regions = regions or {}
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.RLock()
+        self.in_flight = {}
+        self.trimmed = time.monotonic()
+        self.executor = self.start()
+
+    # Start the Workers and Build their Backends
+    def start(self):
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                       initargs=(self.limits.memory,))
+        warming = [executor.submit(warm_worker, self.settings.backend) for _ in range(self.workers)]
+        for future in warming:
+            future.result()
+
+        return executor
+
+    # Report Type of a Request
+    def get_report_type(self, report_type=None, region=None):
+        if report_type in report_fields:
+            return report_type
+        elif report_type is not None:
+            raise ValueError("Unknown report type {}".format(report_type))
+        elif region in self.regions:
+            return self.regions[region].report_type
+        elif region is not None:
+            raise ValueError("Unknown region {}".format(region))
+
+        raise ValueError("Give a report_type (national or regional) or a region")
+
+    # Refuse Files outside the Folders of the Configured Regions
+    def check_path(self, path):
+        real_path = os.path.realpath(path)
+        for region in self.regions.values():
+            folder = os.path.realpath(region.folder)
+            if os.path.commonpath([folder, real_path]) == folder:
+                return
+
+        raise ValueError("{} is not in the folder of a configured region".format(path))
+
+    # Queue a PDF, or Join the Parse of an Identical One
+    def submit(self, name, data, report_type):
+        key = (hashlib.sha256(data).hexdigest(), report_type)
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is None:
+                future = self.executor.submit(limited_extract_values, name, report_type, self.cache,
+                                              self.settings, self.limits.timeout, data)
+                self.in_flight[key] = future
+                future.add_done_callback(partial(self.done, key))
+
+        return future
+
+    def done(self, key, future):
+        with self.lock:
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+
+    # Rows of a Batch of PDFs
+    # NOTE: items are (name, data) pairs, data is the error for a file that could not be read
+    def extract(self, items, report_type):
+        if not self.slots.acquire(timeout=service_queue_timeout):
+            raise ServiceBusy("Too many requests at once, try again later")
+
+        try:
+            executor = self.executor
+            futures = [(name, self.submit(name, data, report_type) if isinstance(data, bytes) else data)
+                       for name, data in items]
+
+            results = []
+            for name, future in futures:
+                if isinstance(future, Exception):
+                    results.append({"file": name, "error": str(future)})
+                    continue
+
+                try:
+                    rows, file_stats = future.result()
+                except BrokenProcessPool as e:
+                    self.restart(executor)
+                    results.append({"file": name, "error": "The worker died: {}".format(e)})
+                    continue
+                except Exception as e:
+                    status = "timeout" if isinstance(e, ParseTimeout) else "failed"
+                    results.append({"file": name, "error": "{}: {}".format(status, e)})
+                    continue
+
+                results.append({"file": name, "rows": rows, "cached": file_stats["cached"],
+                                "seconds": file_stats["total"]})
+        finally:
+            self.slots.release()
+            self.trim_cache()
+
+        return {"report_type": report_type, "headers": get_column_headers(report_type)[0], "results": results}
+
+    # Keep the Extraction Cache under its Size Cap
+    # NOTE: Runs after a request once service_cache_trim_interval seconds have passed since the last trim
+    def trim_cache(self):
+        if self.cache is None:
+            return
+
+        with self.lock:
+            if time.monotonic() - self.trimmed < service_cache_trim_interval:
+                return
+            self.trimmed = time.monotonic()
+
+        try:
+            self.cache.trim()
+        except OSError as e:
+            print("Could not trim the cache: {}".format(e))
+
+    # Replace a Pool Broken by a Dying Worker
+    def restart(self, executor):
+        with self.lock:
+            if self.executor is executor:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.in_flight = {}
+                self.executor = self.start()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+# Raised when Every Request Slot is Taken
+class ServiceBusy(Exception):
+    pass
+
+
+# Build a Worker's Backend before its First Request
+def warm_worker(backend):
+    get_backend(backend)
+
+
+# HTTP Endpoint of the Extraction Service
+# NOTE: GET /health answers {"status": "ok"}. POST /extract takes either a PDF as the body
+#       (Content-Type: application/pdf, with report_type or region and an optional name in the
+#       query string) or JSON naming files on this machine:
+#           {"report_type": "regional", "path": "data/regional/north/X _ Rankings Indicators.pdf"}
+#           {"region": "north", "paths": ["a.pdf", "b.pdf"]}
+#       and answers {"report_type", "headers", "results": [{"file", "rows", "cached", "seconds"}]},
+#       with an "error" instead of the rows for a file that failed
+class ServiceHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/extract":
+            self.send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self.send_json(400, {"error": "Content-Length must be a number of bytes"})
+            return
+        if length > service_max_upload:
+            self.close_connection = True
+            self.send_json(413, {"error": "Uploads are limited to {} bytes".format(service_max_upload)})
+            return
+        body = self.rfile.read(length)
+        service = self.server.service
+
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/pdf"):
+                query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                report_type = service.get_report_type(query.get("report_type"), query.get("region"))
+                items = [(query.get("name", "upload.pdf"), body)]
+            else:
+                request = json.loads(body or b"{}")
+                if not isinstance(request, dict):
+                    raise ValueError("Post a JSON object")
+                report_type = service.get_report_type(get_request_text(request, "report_type"),
+                                                      get_request_text(request, "region"))
+                paths = request.get("paths", [request["path"]] if "path" in request else [])
+                if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+                    raise ValueError("paths must be a list of file names")
+                if not paths:
+                    raise ValueError("Give a path or paths to extract, or post a PDF")
+                for path in paths:
+                    service.check_path(path)
+                items = [(path, read_request_file(path)) for path in paths]
+        except (ValueError, RecursionError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        try:
+            self.send_json(200, service.extract(items, report_type))
+        except ServiceBusy as e:
+            self.send_json(503, {"error": str(e)})
+
+    def send_json(self, status, response):
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        print("{} {}".format(self.address_string(), format % args))
+
+
+# Text Field of a JSON Request, None when Missing
+def get_request_text(request, key):
+    value = request.get(key)
+    if value is not None and not isinstance(value, str):
+        raise ValueError("{} must be a string".format(key))
+
+    return value
+
+
+# Contents of a File Named in a Request, or the Error Reading it
+def read_request_file(path):
     try:
-        with open(csv_file, argument) as output:
-            writer = csv.writer(output, lineterminator="\n")
-            writer.writerows(values)
-        output.close()
-    except FileNotFoundError:
-        print("File is either not found or broken.")
-    except Exception as x:
-        print("Unexpected error. Details: {}".format(x))
-
-
-# Create Log for Files Skipped
-def export_to_log(log_dir, file, lock, folder):
-    # File
-    log_file = log_dir + "\log" + os.path.basename(folder) + ".txt"
-
-    # Write to File
-    if lock:
-        lock = False
-        with open(log_file, "w") as logger:
-            logger.write("Passed {}\n".format(file))
-    else:
-        with open(log_file, "a") as logger:
-            logger.write("Passed {}\n".format(file))
+        return read_file(path)
+    except OSError as e:
+        return e
+
+
+# Identify the Extractor and the Settings that Change its Output
+def extractor_signature(settings):
+    max_pages = ",".join("{}={}".format(report_type, limit)
+                         for report_type, limit in sorted(settings.max_pages.items()))
+
+    return "{}:backend={}:early_exit={}:max_pages={}".format(extractor_version, settings.backend,
+                                                             settings.early_exit, max_pages)
+
+
+# Timings of a Run
+# NOTE: Stage times are summed over every file, so with several workers they can add up to more
+#       than the wall time. Per-file timings are also written as JSON lines to log_file when given
+class RunStats:
+    stage_names = ["discovery", "open", "render", "retrieve", "write"]
+
+    def __init__(self, log_file=None):
+        self.started = time.time()
+        self.clock = time.perf_counter()
+        self.stages = dict.fromkeys(self.stage_names, 0.0)
+        self.files = []
+        self.pages = 0
+        self.cache_hits = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.logger = open(log_file, "w") if log_file else None
+
+    @contextmanager
+    def time_stage(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] += time.perf_counter() - started
+
+    # Add the Timings of a Parsed File
+    def add_file(self, region_name, name, file_stats):
+        record = dict(file_stats, region=region_name, file=name)
+        self.files.append(record)
+        self.pages += file_stats["pages"]
+        self.cache_hits += 1 if file_stats["cached"] else 0
+        for stage in ["open", "render", "retrieve"]:
+            self.stages[stage] += file_stats[stage]
+
+        if self.logger is not None:
+            self.logger.write(json.dumps(record) + "\n")
+
+    def report(self):
+        wall_time = time.perf_counter() - self.clock
+        render_time = self.stages["render"]
+
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_time": wall_time,
+            "files": len(self.files),
+            "pages": self.pages,
+            "cache_hits": self.cache_hits,
+            "unchanged": self.unchanged,
+            "failed": self.failed,
+            "files_per_sec": len(self.files) / wall_time if wall_time else 0.0,
+            "pages_per_sec": self.pages / wall_time if wall_time else 0.0,
+            "render_pages_per_sec": self.pages / render_time if render_time else 0.0,
+            "peak_rss_mb": get_peak_rss(resource.RUSAGE_SELF) if resource else None,
+            "peak_worker_rss_mb": get_peak_rss(resource.RUSAGE_CHILDREN) if resource else None,
+            "stages": self.stages,
+            "per_file": self.files,
+        }
+
+    def close(self):
+        if self.logger is not None:
+            self.logger.close()
+
+
+# Peak Resident Memory in MB
+# NOTE: ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+def get_peak_rss(who):
+    peak = resource.getrusage(who).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+
+    return peak / 1024
+
 
-    logger.close()
+# Hash the Contents of a File
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            digest.update(chunk)
 
-    return lock
+    return digest.hexdigest()
 
 
 # Main
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
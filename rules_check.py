@@ -0,0 +1,235 @@
+# Program    : PDFReader Rules Check
+# Description: Fuzz the Field Table against the elif Chains it Replaced and Report Every Value that Differs
+
+
+# Imports
+import argparse
+import random
+import sys
+
+import program
+
+# Value Changes Made on Purpose
+# NOTE: Fields whose values may differ from the elif chains, with the reason. Any other difference
+#       is reported as a regression
+known_changes = {
+    "national": {
+        "Classes Fewer than 20": "without a % the old chain sliced up to find(\":1\"), which is -1 and "
+                                 "dropped the last character",
+        "Classes More than 50": "without a footnote the old chain kept the % sign",
+    },
+    "regional": {
+        "Avg 6 Year Grade Percentage": "without a % the old chain's elif line.find(\"%\") was always true and "
+                                       "dropped the last character",
+        "Expert Opinion Percentage": "the old chain sliced from find(\"(\") + 2 and lost the first digit",
+        "Avg First-Year Stud Retention Percentage": "the old chain checked for [ but sliced after ], a lone "
+                                                    "[ or ] now picks the branch by ]",
+        "Full-Time Faculty Percentage": "as above, a lone [ or ]",
+        "Classes Fewer than 20": "as above, a lone [ or ]",
+        "Class More than 50": "as above, a lone [ or ]",
+        "SAT/ACT Percentage": "as above, a lone [ or ]",
+        "Freshmen in Top 10% of HS": "as above, a lone [ or ]",
+        "Freshmen in Top 25% of HS": "as above, a lone [ or ]",
+        "Avg Alumni Giving Percentage": "as above, a lone [ or ]",
+    },
+}
+
+# Pieces the Fuzzed Lines are Built from
+line_pieces = [" ", ": ", ":", "(", ")", "%", "12", "7.5", "[1]", "[", "]", "/", ":1", "-", "#", "in", "x"]
+
+
+# Slices of the elif Chains
+def between(line, start, end, offset=2):
+    return line[line.find(start) + offset:line.find(end)]
+
+
+def after(line, start):
+    return line[line.find(start) + 2:]
+
+
+def weight(line):
+    return between(line, "(", "%", 1)
+
+
+def score(line):
+    return program.extract_score(line)
+
+
+def footnoted(line, mark, rest):
+    if line.find(mark) >= 0:
+        return between(line, "]", "%")
+    return rest(line)
+
+
+def percent_or_text(line):
+    if line.find("%") >= 0:
+        return between(line, ":", "%")
+    return after(line, ":")
+
+
+def ratio(line):
+    if line.find("]") >= 0:
+        return after(line, "]")
+    elif line.find("/") >= 0:
+        return after(line, ":")
+    return between(line, ":", ":1")
+
+
+# The elif Chains of retrieve_values before the Field Table
+# NOTE: One (label, slice) pair per branch, in the order of the chain
+old_chains = {
+    "national": [
+        ("is ranked", lambda line: (line[:line.find("is ranked")],
+                                    line[line.find("#") + 1:line.find("in National")].rstrip())),
+        ("Score:", score),
+        ("Graduation Rate Performance Rank", weight),
+        ("Predicted graduation rate:", lambda line: between(line, ":", "%")),
+        ("Overperformance(+)/Underperformance(-)", lambda line: after(line, ":")),
+        ("Alumni Giving", weight),
+        ("Alumni giving rank:", score),
+        ("Average alumni giving rate:", lambda line: footnoted(line, "]", percent_or_text)),
+        ("Graduation and Retention Rates", weight),
+        ("Graduation and retention rank", score),
+        ("6-year graduation rate:", lambda line: footnoted(line, "]", lambda line: between(line, ":", "%"))),
+        ("Average freshman retention rate:",
+         lambda line: footnoted(line, "]", lambda line: between(line, ":", "%"))),
+        ("Undergraduate Academic Reputation", weight),
+        ("Peer assessment score (out of 5):", lambda line: after(line, ":")),
+        ("High school counselor score (out of 5):", lambda line: after(line, ":")),
+        ("Faculty Resources (", weight),
+        ("Faculty Resources Rank:", score),
+        ("Percent of faculty who are full-time:",
+         lambda line: footnoted(line, "]", lambda line: between(line, ":", "%"))),
+        ("Full-time faculty with Ph.D or terminal degree:", percent_or_text),
+        ("Classes with fewer than 20 students: ",
+         lambda line: between(line, ":", "%") if line.find("%") >= 0 else between(line, ":", ":1")),
+        ("Classes with 50 or more students:", lambda line: footnoted(line, "]", lambda line: after(line, ":"))),
+        ("Student-faculty ratio:", ratio),
+        ("Student Selectivity (", weight),
+        ("Student selectivity rank:", score),
+        ("SAT/ACT 25th-75th percentile:",
+         lambda line: after(line, "]") if line.find("]") >= 0 else after(line, ":")),
+        ("Freshmen in top 10 percent of high school class:", lambda line: footnoted(line, "]", percent_or_text)),
+        ("Freshmen in top 25 percent of high school class:", lambda line: footnoted(line, "]", percent_or_text)),
+        ("Fall 2016 acceptance rate:", lambda line: footnoted(line, "]", lambda line: between(line, ":", "%"))),
+        ("Financial Resources (", weight),
+        ("Financial resources rank:", score),
+    ],
+    "regional": [
+        ("is ranked", lambda line: (line[:line.find("is ranked")],
+                                    line[line.find("#") + 1:line.find("in Regional")].rstrip())),
+        ("Score:", score),
+        ("Graduation and Retention Rates", weight),
+        ("Graduation and retention rank", lambda line: after(line, ":")),
+        ("Average 6-year graduation rate",
+         lambda line: footnoted(line, "]", lambda line: between(line, ":", "%") if line.find("%")
+                                else after(line, ":"))),
+        ("6-year graduation rate of students who received", percent_or_text),
+        ("6-year graduation rate of students who did not", percent_or_text),
+        ("Difference between graduation rates of Pell", percent_or_text),
+        ("student retention rate", lambda line: footnoted(line, "[", percent_or_text)),
+        ("Graduation Rate Performance", weight),
+        ("Predicted graduation rate", lambda line: between(line, ":", "%")),
+        ("Overperformance(+)/Underperformance(-)", lambda line: after(line, ":")),
+        ("Expert Opinion", lambda line: between(line, "(", "%")),
+        ("Peer assessment score (out of 5)", lambda line: after(line, ":")),
+        ("High school counselor score", lambda line: after(line, ":")),
+        ("Faculty Resources (", weight),
+        ("Faculty Resources Rank", lambda line: after(line, ":")),
+        ("of faculty who are full-time", lambda line: footnoted(line, "[", percent_or_text)),
+        ("Full-time faculty with Ph.D or terminal degree", percent_or_text),
+        ("Classes with fewer than 20 students", lambda line: footnoted(line, "[", percent_or_text)),
+        ("Classes with 50 or more students", lambda line: footnoted(line, "[", percent_or_text)),
+        ("Student-faculty ratio", ratio),
+        ("Student Excellence (", weight),
+        ("Student excellence rank", lambda line: after(line, ":")),
+        ("SAT/ACT 25th-75th", lambda line: after(line, "]") if line.find("[") >= 0 else after(line, ":")),
+        ("Freshmen in top 10 percent of high", lambda line: footnoted(line, "[", percent_or_text)),
+        ("Freshmen in top 25 percent of high", lambda line: footnoted(line, "[", percent_or_text)),
+        ("Financial Resources (", weight),
+        ("Financial resources rank", lambda line: after(line, ":")),
+        ("Alumni Giving (", weight),
+        ("Alumni giving rank", lambda line: after(line, ":")),
+        ("Average alumni giving rate", lambda line: footnoted(line, "[", percent_or_text)),
+    ],
+}
+
+
+# Main
+def main(argv=None):
+    args = parse_arguments(argv)
+    rand = random.Random(args.seed)
+
+    regressions = 0
+    for report_type in program.report_fields:
+        differences = check_report_type(report_type, args.lines, rand)
+        print("{}: {} lines".format(report_type, args.lines))
+        for header, (count, example) in sorted(differences.items()):
+            reason = known_changes[report_type].get(header)
+            if reason is None:
+                regressions += 1
+                print("  REGRESSION {}: {} lines differ, for example {!r}".format(header, count, example))
+            else:
+                print("  {}: {} lines differ, {}".format(header, count, reason))
+
+    if regressions:
+        print("\n{} fields differ from the elif chains without a known reason".format(regressions))
+        return 1
+
+    print("\nNo differences besides the known changes")
+    return 0
+
+
+# Command Line Arguments
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Fuzz the field table against the elif chains it replaced")
+    parser.add_argument("--lines", type=int, default=200000,
+                        help="Fuzzed lines per report type (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=2018, help="Seed of the fuzzed lines (default: %(default)s)")
+
+    return parser.parse_args(argv)
+
+
+# Compare the Field Table and the elif Chain of a Report Type Line by Line
+# NOTE: Returns {header: (lines that differ, first such line)}. A line matched to different fields
+#       is counted against the field the old chain picked
+def check_report_type(report_type, lines, rand):
+    matcher = program.get_field_matcher(report_type)
+    chain = old_chains[report_type]
+    labels = [label for label, _ in chain]
+
+    differences = {}
+    for _ in range(lines):
+        line = fuzzed_line(rand, labels)
+
+        old_index = next((index for index, label in enumerate(labels) if line.find(label) >= 0), None)
+        new_index = matcher.match(line)
+        if old_index is None and new_index is None:
+            continue
+
+        old_values = chain[old_index][1](line) if old_index is not None else None
+        if not isinstance(old_values, tuple):
+            old_values = (old_values,)
+        new_values = tuple(matcher.fields[new_index].rule(line)) if new_index is not None else None
+
+        if old_index != new_index or old_values != new_values:
+            header = matcher.fields[old_index if old_index is not None else new_index].headers[-1]
+            count, example = differences.get(header, (0, line))
+            differences[header] = (count + 1, example)
+
+    return differences
+
+
+# A Line Holding One or Two Labels between Random Pieces
+def fuzzed_line(rand, labels):
+    parts = [rand.choice(labels)]
+    if rand.random() < 0.1:
+        parts.append(rand.choice(labels))
+    for _ in range(rand.randint(0, 6)):
+        parts.insert(rand.randint(0, len(parts)), rand.choice(line_pieces))
+
+    return "".join(parts)
+
+
+if __name__ == "__main__":
+    sys.exit(main())